@@ -0,0 +1,155 @@
+"""
+Benchmark for the out-of-core partitioned execution mode.
+
+Generates synthetic CSVs of the requested sizes (default 5 and 10 GB), then
+runs a fixed map/reduce step (group-by sum/count/mean plus a global max)
+through partition_runner.py the way the file lane does, and reports wall
+time, throughput and peak RSS. With --baseline it also times a single
+process pandas chunked scan of the same file for comparison.
+
+Usage:
+    python bench_partitioned.py [--sizes 5 10] [--dir /data/bench] [--workers N] [--baseline] [--keep]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import partitioned
+
+STEP_CODE = '''
+import pandas as pd
+
+READ_CSV_KWARGS = {"usecols": ["category", "value"], "dtype": {"category": "category", "value": "float64"}}
+
+def map_partition(df, info):
+    g = df.groupby("category", observed=True)["value"].agg(["sum", "count"])
+    return {"groups": g.to_dict(orient="index"), "max": float(df["value"].max()), "rows": len(df)}
+
+def reduce_partials(partials):
+    totals = {}
+    for p in partials:
+        for cat, agg in p["groups"].items():
+            t = totals.setdefault(cat, [0.0, 0])
+            t[0] += agg["sum"]
+            t[1] += agg["count"]
+    return {
+        "rows": sum(p["rows"] for p in partials),
+        "max_value": max(p["max"] for p in partials),
+        "mean_by_category": {c: s / n for c, (s, n) in sorted(totals.items())},
+    }
+'''
+
+CATEGORIES = [f"cat_{i:02d}" for i in range(50)]
+
+
+def generate_csv(path, size_bytes, seed=0):
+    rng = random.Random(seed)
+    block_rows = 100_000
+    written = 0
+    row_id = 0
+    with open(path, "w", buffering=16 * 1024 * 1024) as f:
+        f.write("id,category,value,ts,note\n")
+        while written < size_bytes:
+            lines = []
+            for _ in range(block_rows):
+                row_id += 1
+                lines.append(
+                    f"{row_id},{rng.choice(CATEGORIES)},{rng.random() * 1000:.4f},"
+                    f"2024-01-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:00:00,note-{rng.randint(0, 10**6)}\n"
+                )
+            chunk = "".join(lines)
+            f.write(chunk)
+            written += len(chunk)
+    return os.path.getsize(path)
+
+
+def peak_child_rss_mb():
+    # ru_maxrss is in KiB on Linux and covers the largest finished child
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+
+def run_partitioned(csv_path, work_dir, workers):
+    step_path = os.path.join(work_dir, "bench_step.py")
+    with open(step_path, "w") as f:
+        f.write(STEP_CODE)
+    plan = partitioned.plan_partitions(csv_path, partitioned.choose_partition_bytes(workers), workers)
+    plan_path = os.path.join(work_dir, "bench_plan.json")
+    with open(plan_path, "w") as f:
+        json.dump(plan, f)
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, partitioned.RUNNER_PATH, step_path, plan_path],
+        capture_output=True, text=True, cwd=work_dir,
+    )
+    elapsed = time.perf_counter() - started
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    return elapsed, len(plan["partitions"]), plan["partition_bytes"], json.loads(proc.stdout)
+
+
+def run_baseline(csv_path):
+    code = (
+        "import pandas as pd, json\n"
+        f"it = pd.read_csv({csv_path!r}, usecols=['category','value'], chunksize=2_000_000)\n"
+        "s = None\n"
+        "for c in it:\n"
+        "    g = c.groupby('category')['value'].agg(['sum','count'])\n"
+        "    s = g if s is None else s.add(g, fill_value=0)\n"
+        "print(json.dumps({'rows': int(s['count'].sum())}))\n"
+    )
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[5, 10], help="CSV sizes in GB")
+    parser.add_argument("--dir", default=None, help="where to write the synthetic CSVs (needs free disk space)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--baseline", action="store_true", help="also time a single-process chunked pandas scan")
+    parser.add_argument("--keep", action="store_true", help="keep generated CSVs")
+    args = parser.parse_args()
+
+    work_dir = args.dir or tempfile.mkdtemp(prefix="adras_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    results = []
+    for size_gb in args.sizes:
+        csv_path = os.path.join(work_dir, f"synthetic_{size_gb:g}gb.csv")
+        if not os.path.exists(csv_path):
+            print(f"generating {csv_path} ...", flush=True)
+            generate_csv(csv_path, int(size_gb * 1024 ** 3))
+        size = os.path.getsize(csv_path)
+        elapsed, n_parts, part_bytes, output = run_partitioned(csv_path, work_dir, args.workers)
+        result = {
+            "size_gb": round(size / 1024 ** 3, 2),
+            "workers": args.workers,
+            "partitions": n_parts,
+            "partition_mb": round(part_bytes / 1024 ** 2, 1),
+            "seconds": round(elapsed, 2),
+            "throughput_mb_s": round(size / 1024 ** 2 / elapsed, 1),
+            "peak_child_rss_mb": round(peak_child_rss_mb(), 1),
+            "rows": output.get("rows"),
+        }
+        if args.baseline:
+            base = run_baseline(csv_path)
+            result["baseline_seconds"] = round(base, 2)
+            result["speedup"] = round(base / elapsed, 2)
+        results.append(result)
+        print(json.dumps(result), flush=True)
+        if not args.keep:
+            os.remove(csv_path)
+
+    print(json.dumps({"available_memory_mb": round(partitioned.available_memory() / 1024 ** 2), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Startup benchmark for the Adras API.
+
+Reports per-module import time for `import main` (via python -X importtime)
+and the time from launching uvicorn to the first healthy /health response.
+
+Usage:
+    python bench_startup.py [--target 2.0] [--runs 3] [--top 15]
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+APP_MODULES = [
+    "main", "settings", "workspace", "splitter",
+    "web_pipeline", "file_pipeline", "external_pipeline", "scraper",
+]
+
+
+def import_times(module="main"):
+    """Return {module: (self_us, cumulative_us)} for a fresh `import <module>`."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [p.strip() for p in line[len("import time:"):].split("|")]
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            continue  # header line
+        name = parts[2].strip()
+        times[name] = (self_us, cumulative_us)
+    if proc.returncode != 0:
+        print(proc.stderr[-2000:], file=sys.stderr)
+    return times
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_healthy(timeout=60.0):
+    port = free_port()
+    env = dict(os.environ, ADRAS_WARM_DELAY=os.getenv("ADRAS_WARM_DELAY", "1.0"))
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - start
+            except Exception:
+                time.sleep(0.02)
+        return None
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", type=float, default=2.0, help="target time-to-first-healthy-response in seconds")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15, help="also show the N slowest third-party imports")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    times = import_times("main")
+    app_times = {m: times[m] for m in APP_MODULES if m in times}
+    slowest = sorted(
+        ((name, t) for name, t in times.items() if name not in APP_MODULES and "." not in name),
+        key=lambda item: item[1][1], reverse=True,
+    )[:args.top]
+
+    healthy = [time_to_healthy() for _ in range(args.runs)]
+    measured = [h for h in healthy if h is not None]
+    best = min(measured) if measured else None
+
+    report = {
+        "import_main_ms": round(times.get("main", (0, 0))[1] / 1000, 1),
+        "app_modules_ms": {m: round(t[1] / 1000, 1) for m, t in app_times.items()},
+        "slowest_imports_ms": {name: round(t[1] / 1000, 1) for name, t in slowest},
+        "time_to_healthy_s": [round(h, 3) if h is not None else None for h in healthy],
+        "target_s": args.target,
+        "meets_target": best is not None and best <= args.target,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"import main: {report['import_main_ms']} ms (cumulative)")
+        for name, ms in report["app_modules_ms"].items():
+            print(f"  {name:<20} {ms:>8} ms")
+        print("slowest top-level imports:")
+        for name, ms in report["slowest_imports_ms"].items():
+            print(f"  {name:<20} {ms:>8} ms")
+        print(f"time to first healthy response: {report['time_to_healthy_s']} (target {args.target}s)")
+        print("PASS" if report["meets_target"] else "FAIL")
+    sys.exit(0 if report["meets_target"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+"""
+Local block cache for remote datasets used by the external lane.
+
+Remote files are read in fixed-size byte ranges that are stored on disk,
+keyed by URL, ETag and offset, so repeated footer and row-group reads across
+iterations (and requests) are served locally. The cache is bounded by size
+and evicts least recently used blocks. Servers that ignore Range requests
+are detected once per URL; their objects are downloaded once and split into
+blocks instead of being re-downloaded for every block.
+
+Generated code reads through it in two ways:
+    from block_cache import open_url, cached_url
+    pd.read_parquet(open_url("s3://bucket/data.parquet"))          # pandas / pyarrow
+    duckdb.sql(f"SELECT ... FROM read_parquet('{cached_url(url)}')")  # DuckDB httpfs
+
+cached_url() points at a range-capable HTTP proxy that the API process
+starts with start_proxy() and advertises through ADRAS_BLOCK_PROXY.
+"""
+import base64
+import fcntl
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, urlparse
+from settings import settings
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+PROXY_ENV = "ADRAS_BLOCK_PROXY"
+# Bytes written since the last eviction, shared by every process using the cache dir
+WRITTEN_COUNTER = "written_since_evict"
+
+
+def normalize_url(url: str) -> str:
+    """Map s3:// and gs:// URLs to plain HTTPS (or to ADRAS_S3_ENDPOINT, path-style, for S3-compatible servers)."""
+    parsed = urlparse(url)
+    if parsed.scheme == "s3":
+        if settings.s3_endpoint:
+            return f"{settings.s3_endpoint.rstrip('/')}/{parsed.netloc}{parsed.path}"
+        return f"https://{parsed.netloc}.s3.amazonaws.com{parsed.path}"
+    if parsed.scheme == "gs":
+        return f"https://storage.googleapis.com/{parsed.netloc}{parsed.path}"
+    return url
+
+
+class BlockCache:
+    def __init__(self, root=None, block_size=None, max_bytes=None, meta_ttl=None):
+        self.root = root or settings.block_cache_dir
+        self.block_size = block_size or settings.block_size
+        self.max_bytes = max_bytes or settings.block_cache_max_bytes
+        self.meta_ttl = settings.block_meta_ttl_seconds if meta_ttl is None else meta_ttl
+        os.makedirs(os.path.join(self.root, "meta"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "blocks"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._fill_locks = {}
+        self._session = None
+        self.stats = {"hits": 0, "misses": 0, "bytes_fetched": 0, "bytes_served": 0, "evicted": 0}
+
+    def _http(self):
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        return self._session
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _meta_path(self, url):
+        return os.path.join(self.root, "meta", hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def _write_meta(self, meta):
+        meta_path = self._meta_path(meta["url"])
+        tmp = f"{meta_path}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+
+    def stat(self, url):
+        """
+        Return {"size", "etag", "ranges"} for url, from the meta cache when it
+        is fresh enough. "ranges" is False if the server ignores Range requests.
+        """
+        url = normalize_url(url)
+        meta_path = self._meta_path(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if time.time() - meta["fetched_at"] < self.meta_ttl:
+                return meta
+        except (OSError, ValueError, KeyError):
+            pass
+
+        resp = self._http().head(url, allow_redirects=True, timeout=30)
+        size = resp.headers.get("Content-Length")
+        ranges = resp.headers.get("Accept-Ranges", "").lower() == "bytes" or None
+        if resp.status_code >= 400 or size is None or ranges is None:
+            # Some servers reject HEAD or don't advertise ranges; a one-byte ranged
+            # GET gives the size in Content-Range and shows whether Range is honoured
+            resp = self._http().get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=30)
+            resp.close()
+            resp.raise_for_status()
+            ranges = resp.status_code == 206
+            content_range = resp.headers.get("Content-Range", "")
+            size = content_range.rsplit("/", 1)[-1] if "/" in content_range else resp.headers.get("Content-Length")
+        etag = resp.headers.get("ETag") or resp.headers.get("Last-Modified") or ""
+        meta = {"url": url, "size": int(size), "etag": etag.strip('"'), "ranges": ranges, "fetched_at": time.time()}
+        self._write_meta(meta)
+        return meta
+
+    def _block_path(self, url, etag, index):
+        key = hashlib.sha256(f"{url}\0{etag}".encode()).hexdigest()
+        return os.path.join(self.root, "blocks", key[:2], f"{key}_{index * self.block_size}")
+
+    def _block(self, url, meta, index):
+        path = self._block_path(url, meta["etag"], index)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # mtime is the LRU clock
+            self._count("hits")
+            return data
+        except FileNotFoundError:
+            pass
+
+        self._count("misses")
+        if meta.get("ranges") is False:
+            return self._fetch_whole(url, meta, index)
+        start = index * self.block_size
+        end = min(start + self.block_size, meta["size"]) - 1
+        resp = self._http().get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=60)
+        resp.raise_for_status()
+        if resp.status_code == 200:
+            # Server ignored the Range header and is sending the whole object:
+            # remember that, and keep every block of it rather than just this one
+            meta = dict(meta, ranges=False)
+            self._write_meta(meta)
+            return self._store_object(url, meta, index, resp)
+        data = resp.content
+        self._count("bytes_fetched", len(data))
+        self._store(path, data)
+        return data
+
+    def _store(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._account(len(data))
+
+    def _account(self, written):
+        """
+        Add written bytes to the counter shared through the cache dir and run
+        evict() once another 5% of max_bytes has been written by any process.
+        Generated programs are short-lived, so a per-process count would
+        rarely reach the threshold.
+        """
+        counter = os.path.join(self.root, "meta", WRITTEN_COUNTER)
+        with open(counter, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                total = int(f.read() or 0) + written
+            except ValueError:
+                total = written
+            due = total >= self.max_bytes * 0.05
+            f.seek(0)
+            f.truncate()
+            f.write("0" if due else str(total))
+        if due:
+            self.evict()
+
+    def _fetch_whole(self, url, meta, index):
+        # One download per object even if several threads miss at once
+        with self._lock:
+            lock = self._fill_locks.setdefault(url, threading.Lock())
+        with lock:
+            path = self._block_path(url, meta["etag"], index)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    return f.read()
+            resp = self._http().get(url, stream=True, timeout=60)
+            resp.raise_for_status()
+            return self._store_object(url, meta, index, resp)
+
+    def _store_object(self, url, meta, index, resp):
+        """Split a full-object response into blocks, store them all and return block index."""
+        wanted = b""
+        buffer = bytearray()
+        current = 0
+        with resp:
+            for chunk in resp.iter_content(chunk_size=self.block_size):
+                buffer.extend(chunk)
+                while len(buffer) >= self.block_size:
+                    block = bytes(buffer[:self.block_size])
+                    del buffer[:self.block_size]
+                    wanted = block if current == index else wanted
+                    self._store(self._block_path(url, meta["etag"], current), block)
+                    self._count("bytes_fetched", len(block))
+                    current += 1
+        if buffer:
+            wanted = bytes(buffer) if current == index else wanted
+            self._store(self._block_path(url, meta["etag"], current), bytes(buffer))
+            self._count("bytes_fetched", len(buffer))
+        return wanted
+
+    def read(self, url, offset, length):
+        """Read length bytes at offset from url through the cache."""
+        url = normalize_url(url)
+        meta = self.stat(url)
+        end = min(offset + length, meta["size"])
+        if offset >= end:
+            return b""
+        chunks = []
+        for index in range(offset // self.block_size, (end - 1) // self.block_size + 1):
+            block = self._block(url, meta, index)
+            block_start = index * self.block_size
+            chunks.append(block[max(offset, block_start) - block_start:end - block_start])
+        data = b"".join(chunks)
+        self._count("bytes_served", len(data))
+        return data
+
+    def usage(self):
+        total = 0
+        blocks = []
+        for dirpath, _, filenames in os.walk(os.path.join(self.root, "blocks")):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                total += st.st_size
+                blocks.append((st.st_mtime, st.st_size, path))
+        return total, blocks
+
+    def evict(self):
+        """Drop least recently used blocks until the cache is back under 90% of max_bytes."""
+        total, blocks = self.usage()
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        for _, size, path in sorted(blocks):
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self._count("evicted", removed)
+        return removed
+
+
+class CachedFile(io.RawIOBase):
+    """Seekable read-only file object over a remote URL, backed by a BlockCache."""
+
+    def __init__(self, url, cache=None):
+        self.url = normalize_url(url)
+        self.cache = cache or get_cache()
+        self.size = self.cache.stat(self.url)["size"]
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        elif whence == io.SEEK_END:
+            self.pos = self.size + offset
+        return self.pos
+
+    def readinto(self, buffer):
+        data = self.cache.read(self.url, self.pos, len(buffer))
+        buffer[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = BlockCache()
+    return _cache
+
+
+def open_url(url):
+    """Open a remote file for reading through the block cache (pandas, pyarrow, csv, ...)."""
+    return io.BufferedReader(CachedFile(url), buffer_size=get_cache().block_size)
+
+
+def cached_url(url):
+    """
+    Return a URL on the local block-cache proxy that serves url, for readers
+    that need an HTTP URL (DuckDB httpfs). Falls back to url when no proxy runs.
+    """
+    proxy = os.getenv(PROXY_ENV)
+    if not proxy:
+        return url
+    token = base64.urlsafe_b64encode(normalize_url(url).encode()).decode().rstrip("=")
+    name = quote(os.path.basename(urlparse(url).path) or "data")
+    return f"{proxy}/u/{token}/{name}"
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    def _target(self):
+        parts = self.path.split("/")
+        if len(parts) < 3 or parts[1] != "u":
+            return None
+        token = parts[2]
+        return base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+
+    def _range(self, size):
+        header = self.headers.get("Range")
+        if not header or not header.startswith("bytes="):
+            return 0, size - 1, False
+        first, _, last = header[len("bytes="):].split(",")[0].partition("-")
+        if first == "":
+            return max(0, size - int(last)), size - 1, True
+        return int(first), min(int(last), size - 1) if last else size - 1, True
+
+    def _respond(self, send_body):
+        url = self._target()
+        if url is None:
+            self.send_error(404)
+            return
+        cache = get_cache()
+        try:
+            meta = cache.stat(url)
+            start, end, partial = self._range(meta["size"])
+        except Exception as e:
+            self.send_error(502, str(e))
+            return
+        self.send_response(206 if partial else 200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{meta["etag"]}"')
+        self.send_header("Content-Length", str(end - start + 1))
+        if partial:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{meta['size']}")
+        self.end_headers()
+        # Stream block by block so full-object GETs don't buffer the whole file
+        pos = start
+        while send_body and pos <= end:
+            chunk = cache.read(url, pos, min(cache.block_size, end - pos + 1))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            pos += len(chunk)
+
+    def do_GET(self):
+        self._respond(True)
+
+    def do_HEAD(self):
+        self._respond(False)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_proxy = None
+_proxy_lock = threading.Lock()
+
+
+def start_proxy(host="127.0.0.1", port=0):
+    """
+    Start the block-cache proxy in a daemon thread (once per process) and
+    export its address, plus this directory on PYTHONPATH, so generated code
+    can `from block_cache import cached_url`.
+    """
+    global _proxy
+    with _proxy_lock:
+        if _proxy is None:
+            _proxy = ThreadingHTTPServer((host, port), ProxyHandler)
+            _proxy.daemon_threads = True
+            threading.Thread(target=_proxy.serve_forever, daemon=True).start()
+            os.environ[PROXY_ENV] = f"http://{host}:{_proxy.server_address[1]}"
+            paths = os.environ.get("PYTHONPATH", "").split(os.pathsep)
+            if APP_DIR not in paths:
+                os.environ["PYTHONPATH"] = os.pathsep.join([APP_DIR] + [p for p in paths if p])
+            print(f"Block cache proxy on {os.environ[PROXY_ENV]} (cache dir {get_cache().root})")
+    return os.environ[PROXY_ENV]
+
+
+def usage() -> dict:
+    cache = get_cache()
+    total, blocks = cache.usage()
+    return {"dir": cache.root, "bytes": total, "blocks": len(blocks), "max_bytes": cache.max_bytes,
+            "block_size": cache.block_size, "proxy": os.getenv(PROXY_ENV), **cache.stats}
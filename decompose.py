@@ -0,0 +1,223 @@
+"""
+Solve multi-part questions one part at a time.
+
+A questions.txt usually asks several numbered sub-questions about the same
+data and wants the answers back in one JSON array or object. Instead of one
+program answering everything (and rerunning everything when one answer is
+wrong), the question is split into parts, the shared data is staged once by
+the lane, and each part is generated, run and checked in parallel with its own
+small iteration budget. Parts the checker never accepted (unverified output
+or a fallback) are retried while time is left; parts that passed are kept. The answers are then assembled in
+the requested shape.
+"""
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from settings import settings, get_client
+from file_pipeline import iterate_in_reqdir, run_code_in_reqdir, CHECKER_MODEL, MAX_STEP_TIMEOUT
+from scheduler import RequestBudget
+
+NUMBERED_PART = re.compile(r"^\s*(?:\d{1,2}|[a-zA-Z])[.)]\s+\S", re.MULTILINE)
+MAX_PARTS = 12
+# Share of the time left that the parallel parts may use; the rest is slack for assembling the answer
+PART_TIME_FRACTION = 0.95
+MAX_ROUNDS = 2
+# Larger CSVs are left for the parts to read directly
+SHARE_MAX_BYTES = 256 * 1024 * 1024
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Parses the CSVs in a step subprocess, so a large parse can't take down the API worker
+share_script = """
+import json, os, sys
+sys.path.insert(0, {app_dir!r})
+import pandas as pd
+from ingest import write_columnar
+paths = {{}}
+for name in {names!r}:
+    stem = os.path.join("columnar", os.path.splitext(name)[0] + "_csv")
+    os.makedirs("columnar", exist_ok=True)
+    try:
+        paths[name] = write_columnar(pd.read_csv(os.path.join("files", name)), stem)
+    except Exception as e:
+        print(f"Could not share {{name}}: {{e}}", file=sys.stderr)
+print(json.dumps(paths))
+"""
+
+split_prompt = """
+You split a data analysis request into independent sub-questions.
+
+Return a JSON object:
+{"format": "array" | "object", "parts": [{"key": "<object key, or null for arrays>", "question": "<sub-question>"}]}
+
+Rules:
+    •	One part per answer the user expects back, in the order the answers must appear.
+    •	"format" is "object" if the user wants a JSON object (then "key" is the exact key they asked for), else "array".
+    •	Each sub-question must be self-contained: repeat the data source and any definitions or filters it depends on, and state the answer type or format requested for it (number, string, base64 image, ...).
+    •	Do not solve anything. Output only the JSON.
+"""
+
+part_instructions = """
+You are answering ONE part of a multi-part question; the other parts are answered separately.
+Answer only the part below. End your code with: import json; print(json.dumps({"answer": answer})), where answer is this part's answer alone, in the format requested for it.
+"""
+
+_lock = threading.Lock()
+_stats = {"decomposed": 0, "parts": 0, "part_retries": 0, "parts_unverified": 0, "parts_fallback": 0}
+
+
+def looks_multipart(question):
+    return len(NUMBERED_PART.findall(question)) >= 2
+
+
+def split_question(question, budget):
+    """
+    Ask the LLM to split question into parts. Returns {"format", "parts"} or
+    None if the question is not worth splitting (fewer than two parts).
+    """
+    if not looks_multipart(question):
+        return None
+    try:
+        with budget.timed("llm"):
+            completion = get_client(budget.llm_timeout()).chat.completions.create(
+                model=CHECKER_MODEL,
+                messages=[
+                    {"role": "system", "content": split_prompt},
+                    {"role": "user", "content": question},
+                ],
+                temperature=0,
+                response_format={"type": "json_object"},
+            )
+        plan = json.loads(completion.choices[0].message.content)
+        parts = [p for p in plan.get("parts", []) if isinstance(p, dict) and p.get("question")]
+        fmt = "object" if plan.get("format") == "object" else "array"
+    except Exception as e:
+        print(f"Question split failed: {e}")
+        return None
+    if fmt == "object" and any(not p.get("key") for p in parts):
+        return None
+    if not 2 <= len(parts) <= MAX_PARTS:
+        return None
+    return {"format": fmt, "parts": parts}
+
+
+def share_csvs(metadata, req_dir, budget=None):
+    """
+    Parse each probed CSV up to SHARE_MAX_BYTES once into a columnar copy, so
+    parallel parts load that instead of each re-parsing the CSV. Adds
+    columnar_path (relative to req_dir) to the entries and returns how many
+    were shared.
+    """
+    budget = budget or RequestBudget()
+    entries = {}
+    for entry in metadata:
+        if not isinstance(entry, dict) or "error" in entry or "columnar_path" in entry \
+                or not str(entry.get("file", "")).lower().endswith(".csv"):
+            continue
+        try:
+            if os.path.getsize(os.path.join(req_dir, "files", entry["file"])) <= SHARE_MAX_BYTES:
+                entries[entry["file"]] = entry
+        except OSError:
+            continue
+    if not entries:
+        return 0
+    code = share_script.format(app_dir=APP_DIR, names=sorted(entries))
+    with budget.timed("exec"):
+        stdout, stderr = run_code_in_reqdir(code, req_dir, timeout=budget.step_timeout(MAX_STEP_TIMEOUT))
+    if stderr:
+        print(stderr)
+    try:
+        paths = json.loads(stdout.splitlines()[-1])
+    except (IndexError, ValueError):
+        return 0
+    for name, path in paths.items():
+        entries[name]["columnar_path"] = path
+    return len(paths)
+
+
+def _part_budget(budget):
+    return budget.sub_budget(PART_TIME_FRACTION, max_iterations=settings.part_max_iterations)
+
+
+def _answer(result):
+    """Unwrap a part result printed as {"answer": ...}."""
+    if isinstance(result, dict):
+        if set(result) == {"stdout", "stderr"}:
+            try:
+                result = json.loads(result["stdout"])
+            except ValueError:
+                return result["stdout"]
+        if isinstance(result, dict) and set(result) == {"answer"}:
+            return result["answer"]
+    return result
+
+
+def solve_in_parts(question, system_prompt, context, base_path, metadata=None, budget=None, prepare=None):
+    """
+    Answer a multi-part question part by part. context is the lane's
+    description of the staged data; with prepare, it is instead built by
+    prepare() once the question has split, so staging only the parts need is
+    skipped otherwise. Returns the assembled answer, or None if the question
+    does not split, so the lane answers it in one piece.
+    """
+    budget = budget or RequestBudget()
+    plan = split_question(question, budget)
+    if plan is None:
+        return None
+    if prepare is not None:
+        context = prepare()
+    parts = plan["parts"]
+    print(f"Decomposed into {len(parts)} parts ({plan['format']})")
+
+    conversations = [[
+        {"role": "system", "content": system_prompt + part_instructions},
+        {"role": "user", "content": f"{context}\n\nFull question (for context only):\n{question}\n\n"
+                                    f"Answer only this part:\n{p['question']}"},
+    ] for p in parts]
+    answers = [None] * len(parts)
+    outcomes = ["ok"] * len(parts)
+    failed = list(range(len(parts)))
+
+    def solve(index):
+        sub = _part_budget(budget)
+        result = iterate_in_reqdir(conversations[index], parts[index]["question"], base_path,
+                                   budget=sub, metadata=metadata)
+        return index, _answer(result), sub
+
+    rounds = 0
+    with ThreadPoolExecutor(max_workers=min(settings.decompose_workers, len(parts))) as pool:
+        # Retry rounds continue each failing part's conversation, so it sees its earlier attempts
+        while failed and rounds < MAX_ROUNDS and (rounds == 0 or _part_budget(budget).can_iterate()):
+            if rounds:
+                print(f"Retrying parts {[i + 1 for i in failed]}")
+                with _lock:
+                    _stats["part_retries"] += len(failed)
+            rounds += 1
+            still_failing = []
+            for index, answer, sub in pool.map(solve, failed):
+                budget.iterations += sub.iterations
+                # An unverified or fallback answer is kept only until a retry does better
+                answers[index], outcomes[index] = answer, sub.outcome
+                if sub.outcome in ("unverified", "fallback"):
+                    still_failing.append(index)
+            failed = still_failing
+
+    with _lock:
+        _stats["decomposed"] += 1
+        _stats["parts"] += len(parts)
+        _stats["parts_unverified"] += sum(1 for i in failed if outcomes[i] == "unverified")
+        _stats["parts_fallback"] += sum(1 for i in failed if outcomes[i] == "fallback")
+    if failed:
+        print(f"Parts {[i + 1 for i in failed]} were never accepted by the checker")
+        all_fell_back = len(failed) == len(parts) and all(outcomes[i] == "fallback" for i in failed)
+        budget.outcome = "fallback" if all_fell_back else "unverified"
+
+    if plan["format"] == "object":
+        return {p["key"]: a for p, a in zip(parts, answers)}
+    return answers
+
+
+def usage() -> dict:
+    with _lock:
+        return dict(_stats)
@@ -1,17 +1,16 @@
 import json
 import os
-from groq import Groq
-from dotenv import load_dotenv
+from settings import get_client
+from workspace import request_dir
+from block_cache import start_proxy
+from scheduler import RequestBudget
+from preflight import check_code, PRINT_ANY
 from web_pipeline import ask_llm
 from web_pipeline import extract_python_code
-from web_pipeline import run_code
+from web_pipeline import run_code, MAX_STEP_TIMEOUT
 from web_pipeline import replace_base64, fail_proof
 import ast
 
-load_dotenv()
-api_key = os.getenv("GROQ_API_KEY")
-client = Groq(api_key=api_key)
-
 system_prompt = """
 You are Adras, an autonomous AI data analyst.
 
@@ -24,11 +23,12 @@ You must:
     •	If a specific format (e.g. JSON array, base64 plot) is requested, format output accordingly.
     •	Return only the Python code, with no explanation or markdown formatting.
     •	When working with large datasets, never load the entire dataset into memory. Only load the necessary columns or rows.
+    •	Read remote files (http(s)://, s3://, gs://) through the local block cache so repeated reads are served from disk: `from block_cache import open_url, cached_url`. For pandas/pyarrow use pd.read_parquet(open_url(url), columns=[...]) or pd.read_csv(open_url(url)). For DuckDB use INSTALL httpfs; LOAD httpfs; and read_parquet('<cached_url(url)>') for single files. Glob patterns (e.g. s3://bucket/*.parquet) must be read directly.
     •	When a task includes specific instructions for visualizations (e.g., "use a dotted red line", "label axes", "keep image size under 100kB"), follow them **exactly**. Do not ignore stylistic or formatting requests, especially for plots.
 """
 
-def checker_llm(question, summarized_stdout, stderr):
-    response = client.chat.completions.create(
+def checker_llm(question, summarized_stdout, stderr, timeout=None):
+    response = get_client(timeout).chat.completions.create(
         messages=[
             {"role": "system", "content": "You are a binary task checker. Answer exactly 'yes' if the code output successfully matches the expected output even if the base64 is truncated, else answer 'no'."},
             {"role": "user", "content": f"User question:\n{question}\n\nCode output:\n{summarized_stdout}\n\nCode errors:\n{stderr}\n\nIf the task is complete and the output contains the requested final result in JSON form (base64 will be truncated), reply 'yes'. Otherwise reply 'no'."}
@@ -112,31 +112,42 @@ def clean_json(stdout):
     )
     return s
 
-def external_pipeline(req_id):
-    question = open(f"temp/{req_id}/questions.txt").read()
+def external_pipeline(req_id, budget=None):
+    budget = budget or RequestBudget()
+    req_dir = request_dir(req_id)
+    question = open(os.path.join(req_dir, "questions.txt")).read()
+    start_proxy()
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": question}
     ]
-    max_iterations = 5
     clean_stdout = ""
-    iteration = 0
-    while iteration < max_iterations:
-        iteration += 1
-        print(f"\n=== Iteration {iteration} ===")
-        raw_code = ask_llm(messages)
+    while budget.can_iterate():
+        iteration = budget.start_iteration()
+        print(f"\n=== Iteration {iteration} ({budget.remaining():.0f}s left) ===")
+        with budget.timed("llm"):
+            raw_code = ask_llm(messages, timeout=budget.llm_timeout())
         code = extract_python_code(raw_code)
         print(f"Generated code:\n{code}")
-        stdout, stderr = run_code(code)
+        preflight_feedback = check_code(code, contract=PRINT_ANY)
+        if preflight_feedback:
+            messages.append({"role": "assistant", "content": code})
+            messages.append({"role": "user", "content": preflight_feedback})
+            continue
+        with budget.timed("exec"):
+            stdout, stderr = run_code(code, req_dir, timeout=budget.step_timeout(MAX_STEP_TIMEOUT))
         clean_stdout = clean_json(extract_json(stdout))
         print(f"Code output:\n{clean_stdout}\nErrors:\n{stderr}")
-        if (checker_llm(question, replace_base64(clean_stdout), stderr) == "yes"):
+        with budget.timed("check"):
+            done = checker_llm(question, replace_base64(clean_stdout), stderr, timeout=budget.llm_timeout()) == "yes"
+        if done:
             print("Task complete. Returning final output.")
             return ast.literal_eval(clean_stdout)
         else:
             messages.append({"role": "assistant", "content": code})
             messages.append({"role": "user", "content": "Output = " + replace_base64(clean_stdout) + "\nErrors = " + stderr})
             continue
-    print("Max iterations reached. Task failed.")
-    return json.loads(fail_proof(clean_stdout, question))
+    print("Request budget exhausted. Task failed.")
+    budget.outcome = "fallback"
+    return json.loads(fail_proof(clean_stdout, question, timeout=budget.llm_timeout(fallback=True)))
 
@@ -1,22 +1,24 @@
 import os
-import pandas as pd
-import subprocess
 import json
 import time
-from groq import Groq
-from dotenv import load_dotenv
 import re
 from io import open as io_open
 import hashlib
+import threading
 from web_pipeline import fail_proof
-
-load_dotenv()
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+from ingest import ingest_excel
+from settings import settings, get_client
+from workspace import request_dir, run_step
+from scheduler import RequestBudget
+from preflight import check_code, column_hints, PRINT_JSON
 
 # Models (you can tweak)
 MAIN_MODEL = "openai/gpt-oss-120b"
 CHECKER_MODEL = "openai/gpt-oss-20b"
 
+# Upper bound for one step; the request budget usually hands out less
+MAX_STEP_TIMEOUT = 180
+
 # helpers
 def replace_base64(text: str) -> str:
     """Truncate long base64-like strings in the given text to avoid context bloat."""
@@ -44,6 +46,8 @@ def summarize_base64_in_text(text: str) -> str:
     return base64_pattern.sub(repl, text)
 
 def probe_csv_structure(file_path):
+    # pandas is only needed once a file lane request actually runs
+    import pandas as pd
     df = pd.read_csv(file_path, nrows=50)
     structure_info = {
         "file": os.path.basename(file_path),
@@ -62,35 +66,38 @@ def extract_python_code(text):
         t = re.sub(r"\s*```$", "", t)
     return t.strip()
 
-def llm_call(messages, model):
+def llm_call(messages, model, timeout=None):
     # Clean all messages before sending
     cleaned_messages = [{"role": m["role"], "content": replace_base64(m["content"])} for m in messages]
-    resp = client.chat.completions.create(
+    resp = get_client(timeout).chat.completions.create(
         model=model,
         messages=cleaned_messages,
         temperature=0,
     )
     return resp.choices[0].message.content
 
-def run_code_in_reqdir(code: str, req_dir: str, timeout: int = 120):
-    temp_code_path = os.path.join(req_dir, f"step_code_{int(time.time()*1000)}.py")
+def run_code_in_reqdir(code: str, req_dir: str, timeout: int = 120, runner=None, runner_args=()):
+    """
+    Write code to a step file in req_dir and run it there. With runner, the
+    step file is passed to that script (python3 runner step.py *runner_args)
+    instead of being executed directly.
+    """
+    # Thread id keeps parallel steps in the same request dir apart
+    temp_code_path = os.path.join(req_dir, f"step_code_{int(time.time()*1000)}_{threading.get_ident()}.py")
     with io_open(temp_code_path, "w", encoding="utf-8") as f:
         f.write(code)
+    cmd = ["python3", os.path.basename(temp_code_path)]
+    if runner:
+        cmd = ["python3", runner, os.path.basename(temp_code_path), *runner_args]
     try:
-        proc = subprocess.run(
-            ["python3", temp_code_path],
-            capture_output=True,
-            text=True,
-            timeout=timeout
-        )
-        stdout = proc.stdout or ""
-        stderr = proc.stderr or ""
-    except subprocess.TimeoutExpired as e:
-        stdout = e.stdout or ""
-        stderr = (e.stderr or "") + f"\nTIMEOUT: exceeded {timeout}s"
-    except Exception as e:
-        stdout = ""
-        stderr = str(e)
+        # Run inside the request dir so relative paths like files/<name> resolve
+        stdout, stderr = run_step(cmd, req_dir, timeout)
+    finally:
+        # Step files are only needed for the run itself; don't let them pile up
+        try:
+            os.remove(temp_code_path)
+        except OSError:
+            pass
     return stdout.strip(), stderr.strip()
 
 def extract_json_from_text(text: str):
@@ -114,8 +121,8 @@ def extract_json_from_text(text: str):
     except Exception:
         return None
 
-def file_pipeline(req_id: str):
-    base_path = os.path.join("temp", req_id)
+def file_pipeline(req_id: str, budget=None):
+    base_path = request_dir(req_id)
     question_path = os.path.join(base_path, "questions.txt")
     files_path = os.path.join(base_path, "files")
 
@@ -128,36 +135,94 @@ def file_pipeline(req_id: str):
     if not os.path.isdir(files_path):
         raise FileNotFoundError(f"files folder not found for req {req_id}")
 
-    structure_list = []
-    for filename in sorted(os.listdir(files_path)):
-        if filename.lower().endswith(".csv"):
-            full = os.path.join(files_path, filename)
-            try:
-                structure_list.append(probe_csv_structure(full))
-            except Exception as e:
-                structure_list.append({"file": filename, "error": str(e)})
-
+    structure_list = probe_files(files_path)
     structure_str = json.dumps(structure_list, indent=2)
 
+    # Inputs too large for memory run as a partitioned map/reduce instead
+    from partitioned import find_large_csv, partitioned_pipeline
+    large_csv = find_large_csv(files_path)
+    if large_csv:
+        return partitioned_pipeline(question, structure_list, large_csv, base_path, budget=budget)
+
+    system_prompt = (
+        "You are Adras, an autonomous data analyst. "
+        "You will be given a user question and structure metadata for the uploaded files. "
+        "Return only Python code (no explanations) that reads the CSV(s) from the 'files' folder "
+        "and prints the final result (JSON) to stdout when done. "
+        "Excel sheets have already been converted: load each sheet from its 'columnar_path' "
+        "(pd.read_parquet, or pd.read_pickle for .pkl) instead of reading the workbook."
+    )
+
+    if settings.decompose_questions:
+        from decompose import solve_in_parts, looks_multipart, share_csvs
+        if looks_multipart(question):
+            def prepare():
+                note = ""
+                if share_csvs(structure_list, base_path, budget):
+                    note = "CSVs with a 'columnar_path' have been parsed once into that copy; load it instead of the CSV.\n\n"
+                return note + f"File structure metadata:\n{json.dumps(structure_list, indent=2)}"
+            result = solve_in_parts(question, system_prompt, None, base_path, metadata=structure_list,
+                                    budget=budget, prepare=prepare)
+            if result is not None:
+                return result
+
     messages = [
-        {"role": "system", "content": (
-            "You are Adras, an autonomous data analyst. "
-            "You will be given a user question and CSV structure metadata. "
-            "Return only Python code (no explanations) that reads the CSV(s) from the 'files' folder "
-            "and prints the final result (JSON) to stdout when done."
-        )},
-        {"role": "user", "content": f"Question:\n{question}\n\nCSV structure metadata:\n{structure_str}"}
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"Question:\n{question}\n\nFile structure metadata:\n{structure_str}"}
     ]
+    return iterate_in_reqdir(messages, question, base_path, budget=budget, metadata=structure_list)
 
-    iteration = 0
-    while True:
-        iteration += 1
-        raw_resp = llm_call(messages, MAIN_MODEL)
+def probe_files(files_path):
+    """
+    Collect structure metadata for the uploads in files_path. Excel workbooks
+    are ingested once: every sheet gets a columnar copy under columnar/ that
+    generated code loads instead of re-parsing the workbook.
+    """
+    req_dir = os.path.dirname(os.path.normpath(files_path))
+    structure_list = []
+    for filename in sorted(os.listdir(files_path)):
+        full = os.path.join(files_path, filename)
+        lower = filename.lower()
+        try:
+            if lower.endswith(".csv"):
+                structure_list.append(probe_csv_structure(full))
+            elif lower.endswith((".xlsx", ".xls")):
+                structure_list.extend(ingest_excel(full, req_dir))
+        except Exception as e:
+            structure_list.append({"file": filename, "error": str(e)})
+    return structure_list
+
+def iterate_in_reqdir(messages, question, base_path, budget=None, max_timeout=MAX_STEP_TIMEOUT,
+                      run=run_code_in_reqdir, metadata=None, contract=PRINT_JSON):
+    """
+    Generate, run (inside base_path) and check code until the checker accepts
+    or the request budget has no room for another iteration. Code that fails
+    the static pre-flight check for contract is sent back without being run;
+    when a step errors, column names it uses are checked against metadata
+    and the hint is added to its errors.
+    """
+    budget = budget or RequestBudget()
+    stdout = ""
+    while budget.can_iterate():
+        iteration = budget.start_iteration()
+        with budget.timed("llm"):
+            raw_resp = llm_call(messages, MAIN_MODEL, timeout=budget.llm_timeout())
         code = extract_python_code(raw_resp)
         if not code:
             raise RuntimeError("LLM did not return any code. Raw response:\n" + str(raw_resp))
 
-        stdout, stderr = run_code_in_reqdir(code, base_path, timeout=180)
+        preflight_feedback = check_code(code, contract)
+        if preflight_feedback:
+            messages.append({"role": "assistant", "content": replace_base64(raw_resp)})
+            messages.append({"role": "user", "content": preflight_feedback})
+            continue
+
+        timeout = budget.step_timeout(max_timeout)
+        print(f"Iteration {iteration}: step timeout {timeout:.0f}s, {budget.remaining():.0f}s left")
+        with budget.timed("exec"):
+            stdout, stderr = run(code, base_path, timeout=timeout)
+        if stderr.strip():
+            stderr += column_hints(code, metadata)
 
         # Append assistant output (cleaned)
         messages.append({"role": "assistant", "content": replace_base64(raw_resp)})
@@ -169,7 +234,8 @@ def file_pipeline(req_id: str):
             {"role": "system", "content": "You are a binary task checker. Answer exactly 'yes' if the user's task is fully complete, else answer 'no'."},
             {"role": "user", "content": f"User question:\n{question}\n\nCode output:\n{summarized_stdout}\n\nCode errors:\n{stderr}\n\nIf the task is complete and the output contains the requested final result in JSON form, reply 'yes'. Otherwise reply 'no'."}
         ]
-        decision = llm_call(checker_messages, CHECKER_MODEL)
+        with budget.timed("check"):
+            decision = llm_call(checker_messages, CHECKER_MODEL, timeout=budget.llm_timeout())
         decision_text = decision.strip().lower()
 
         # Append feedback (cleaned)
@@ -182,9 +248,13 @@ def file_pipeline(req_id: str):
                 return json_result
             return {"stdout": stdout, "stderr": stderr}
 
-        if iteration >= 10:
-            json_result = extract_json_from_text(stdout)
-            if json_result is not None:
-                return json_result
-            return json.loads(fail_proof(stdout, question))
+    # Out of time (or iterations): answer within the deadline instead of looping on
+    print("Request budget exhausted. Falling back.")
+    json_result = extract_json_from_text(stdout)
+    if json_result is not None:
+        # The last output parsed, but the checker never accepted it
+        budget.outcome = "unverified"
+        return json_result
+    budget.outcome = "fallback"
+    return json.loads(fail_proof(stdout, question, timeout=budget.llm_timeout(fallback=True)))
 
@@ -0,0 +1,441 @@
+import os
+import re
+import json
+import time
+from scheduler import RequestBudget
+
+HEADER_SCAN_ROWS = 30
+SAMPLE_ROWS = 5
+# Rows per Parquet row group when streaming a sheet
+BATCH_ROWS = 50_000
+MAX_HTML_TABLES = 25
+FETCH_TIMEOUT = 30
+# Share of the request's time left that fetching all pages may use
+FETCH_TIME_FRACTION = 0.25
+
+
+def _is_empty(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _safe_name(name):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", str(name)).strip("_") or "sheet"
+
+
+def write_columnar(df, path_stem):
+    """
+    Write df next to path_stem as Parquet (or a pandas pickle when pyarrow is
+    missing) and return the path written. Mixed-type object columns are
+    stored as strings so Parquet accepts them.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        path = path_stem + ".pkl"
+        df.to_pickle(path)
+        return path
+
+    path = path_stem + ".parquet"
+    try:
+        df.to_parquet(path, index=False)
+    except Exception:
+        df = df.copy()
+        for col in df.columns:
+            if df[col].dtype == object:
+                df[col] = df[col].map(lambda v: None if v is None else str(v))
+        df.to_parquet(path, index=False)
+    return path
+
+
+def detect_header_row(rows):
+    """
+    Return the index of the first row that looks like a header: at least half
+    as wide as the widest row and mostly text. Title and note rows above the
+    table are skipped. Returns None when no row qualifies (e.g. an all-numeric
+    sheet), so every row is kept as data.
+    """
+    widths = [sum(1 for v in row if not _is_empty(v)) for row in rows]
+    if not widths or max(widths) == 0:
+        return None
+    widest = max(widths)
+    for i, row in enumerate(rows):
+        cells = [v for v in row if not _is_empty(v)]
+        if len(cells) < max(1, widest / 2):
+            continue
+        text_cells = sum(1 for v in cells if isinstance(v, str))
+        if text_cells / len(cells) >= 0.6:
+            return i
+    return None
+
+
+def _header_names(header, ncols):
+    names = []
+    seen = {}
+    for i in range(ncols):
+        value = header[i] if i < len(header) else None
+        name = f"column_{i}" if _is_empty(value) else str(value).strip()
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _scan_header(row_iter):
+    """
+    Read rows until HEADER_SCAN_ROWS non-empty ones are seen and detect the
+    header among them. Returns (0-based sheet row of the header, column
+    names, the data rows already read), or None for an empty sheet. Without a
+    header row the header is None and the columns are named column_<i>. The
+    width is taken from the header and the scanned rows.
+    """
+    head = []
+    row_numbers = []
+    for i, row in enumerate(row_iter):
+        if all(_is_empty(v) for v in row):
+            continue
+        head.append(row)
+        row_numbers.append(i)
+        if len(head) >= HEADER_SCAN_ROWS:
+            break
+    if not head:
+        return None
+
+    header_idx = detect_header_row(head)
+    header = head[header_idx] if header_idx is not None else ()
+    data = head[header_idx + 1:] if header_idx is not None else head
+    ncols = 0
+    for row in [header] + data:
+        for i in range(len(row) - 1, -1, -1):
+            if not _is_empty(row[i]):
+                ncols = max(ncols, i + 1)
+                break
+    header_row = row_numbers[header_idx] if header_idx is not None else None
+    return header_row, _header_names(header, ncols), data
+
+
+def _row_batches(first_rows, row_iter, columns, string_columns=(), batch_rows=BATCH_ROWS):
+    """
+    Yield DataFrames of at most batch_rows non-empty rows, padded or cut to
+    len(columns). Values in string_columns are converted to str.
+    """
+    import pandas as pd
+
+    ncols = len(columns)
+    as_text = [columns.index(c) for c in string_columns]
+
+    def frame(rows):
+        records = []
+        for row in rows:
+            record = list(row[:ncols]) + [None] * (ncols - len(row))
+            for i in as_text:
+                if record[i] is not None:
+                    record[i] = str(record[i])
+            records.append(record)
+        return pd.DataFrame.from_records(records, columns=columns).infer_objects()
+
+    batch = list(first_rows)
+    for row in row_iter:
+        if all(_is_empty(v) for v in row):
+            continue
+        batch.append(row)
+        if len(batch) >= batch_rows:
+            yield frame(batch)
+            batch = []
+    if batch:
+        yield frame(batch)
+
+
+class _MixedColumns(Exception):
+    """A batch doesn't fit the schema; retypes maps each offending column to "float" or "str"."""
+
+    def __init__(self, retypes):
+        super().__init__(f"mixed-type columns: {sorted(retypes)}")
+        self.retypes = retypes
+
+
+def _arrow_batch(df, schema):
+    """Convert df to an Arrow table matching schema (None: inferred), or raise _MixedColumns."""
+    import pyarrow as pa
+
+    try:
+        return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    retypes = {}
+    for col in df.columns:
+        target = schema.field(col).type if schema is not None else None
+        try:
+            pa.array(df[col], type=target, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Integers followed by fractions widen to float; anything else is kept as text
+            numeric = target is not None and pa.types.is_integer(target) and df[col].dtype.kind in "iuf"
+            retypes[col] = "float" if numeric else "str"
+    raise _MixedColumns(retypes or {col: "str" for col in df.columns})
+
+
+def _write_sheet(row_iter, path_stem, retypes=None):
+    """
+    Stream a sheet's rows to a columnar copy next to path_stem in batches of
+    BATCH_ROWS, so a large sheet is never held in memory whole. Returns the
+    sheet metadata, or None for an empty sheet. The first batch fixes the
+    Parquet schema (with retypes applied); a batch that doesn't fit raises
+    _MixedColumns and the caller re-reads the sheet with the wider types.
+    Without pyarrow the batches are concatenated and pickled.
+    """
+    import pandas as pd
+
+    scan = _scan_header(row_iter)
+    if scan is None:
+        return None
+    header_row, columns, first_rows = scan
+    retypes = retypes or {}
+    batches = _row_batches(first_rows, row_iter, columns, [c for c, t in retypes.items() if t == "str"])
+    meta = {"header_row": header_row, "columns": columns}
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        frames = list(batches)
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+        meta.update(path=write_columnar(df, path_stem), dtypes=df.dtypes.astype(str).to_dict(), num_rows=len(df),
+                    sample_rows=json.loads(df.head(SAMPLE_ROWS).to_json(orient="records", date_format="iso")))
+        return meta
+
+    path = path_stem + ".parquet"
+    writer = None
+    num_rows = 0
+    sample = pd.DataFrame(columns=columns)
+    try:
+        for df in batches:
+            if writer is None:
+                table = _arrow_batch(df, None)
+                # All-empty columns in the first batch would pin the type to null
+                schema = pa.schema([
+                    f.with_type(pa.float64()) if retypes.get(f.name) == "float"
+                    else f.with_type(pa.string()) if pa.types.is_null(f.type) else f
+                    for f in table.schema]).remove_metadata()
+                table = table.cast(schema)
+                writer = pq.ParquetWriter(path, schema)
+                sample = df.head(SAMPLE_ROWS)
+            else:
+                table = _arrow_batch(df, schema)
+            writer.write_table(table)
+            num_rows += table.num_rows
+    except _MixedColumns:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    if writer is None:
+        pq.write_table(pa.Table.from_pandas(sample, preserve_index=False), path)
+    else:
+        writer.close()
+    dtypes = pq.read_schema(path).empty_table().to_pandas().dtypes
+    meta.update(path=path, dtypes=dtypes.astype(str).to_dict(), num_rows=num_rows,
+                sample_rows=json.loads(sample.to_json(orient="records", date_format="iso")))
+    return meta
+
+
+def _iter_workbook_sheets(file_path):
+    """Yield (sheet_name, row iterator) for every sheet, reading .xlsx in read-only streaming mode."""
+    if file_path.lower().endswith(".xls"):
+        import pandas as pd
+        sheets = pd.read_excel(file_path, sheet_name=None, header=None)
+        for name, frame in sheets.items():
+            yield name, (tuple(None if pd.isna(v) else v for v in row) for row in frame.itertuples(index=False))
+        return
+
+    from openpyxl import load_workbook
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            yield ws.title, ws.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def _sheet_rows(file_path, sheet_name):
+    """Re-open one sheet and return its row iterator."""
+    for name, rows in _iter_workbook_sheets(file_path):
+        if name == sheet_name:
+            yield from rows
+            return
+
+
+def ingest_excel(file_path, req_dir, out_subdir="columnar"):
+    """
+    Convert every sheet of an Excel workbook into a columnar copy under
+    <req_dir>/<out_subdir>/ and return per-sheet metadata (header row,
+    columns, dtypes, row count, sample rows and the path to load).
+    """
+    out_dir = os.path.join(req_dir, out_subdir)
+    os.makedirs(out_dir, exist_ok=True)
+    stem = _safe_name(os.path.splitext(os.path.basename(file_path))[0])
+
+    sheets = []
+    for sheet_name, rows in _iter_workbook_sheets(file_path):
+        entry = {"file": os.path.basename(file_path), "sheet": sheet_name}
+        path_stem = os.path.join(out_dir, f"{stem}__{_safe_name(sheet_name)}")
+        retypes = {}
+        try:
+            while True:
+                try:
+                    meta = _write_sheet(iter(rows), path_stem, retypes)
+                    break
+                except _MixedColumns as e:
+                    if all(retypes.get(c) == "str" for c in e.retypes):
+                        raise
+                    # A float column that still doesn't fit falls back to text
+                    retypes.update({c: "str" if c in retypes else t for c, t in e.retypes.items()})
+                    rows = _sheet_rows(file_path, sheet_name)
+            if meta is None:
+                entry["empty"] = True
+            else:
+                path = meta.pop("path")
+                entry.update(meta, columnar_path=os.path.relpath(path, req_dir))
+        except Exception as e:
+            entry["error"] = str(e)
+        sheets.append(entry)
+    return sheets
+
+
+def _flatten_header(column):
+    if isinstance(column, tuple):
+        parts = []
+        for level in column:
+            text = str(level).strip()
+            if text and not text.startswith("Unnamed:") and text not in parts:
+                parts.append(text)
+        return " | ".join(parts)
+    return str(column).strip()
+
+
+def _dedupe(names):
+    seen = {}
+    out = []
+    for i, name in enumerate(names):
+        name = name or f"column_{i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 0
+        out.append(name)
+    return out
+
+
+def _html_tables(html):
+    """
+    Parse every <table> on the page into (parsed, raw) frames. Each table is
+    parsed on its own so both frames line up: once with pandas.read_html type
+    inference, and once with a str converter on every column so the raw frame
+    keeps the cell text exactly. Tables pandas can't parse (no rows) are skipped.
+    """
+    import pandas as pd
+    import lxml.html
+    from io import StringIO
+
+    tables = []
+    for element in lxml.html.fromstring(html).iter("table"):
+        source = lxml.html.tostring(element, encoding="unicode")
+        try:
+            df = pd.read_html(StringIO(source), flavor="lxml")[0]
+        except ValueError:
+            continue
+        raw = pd.read_html(StringIO(source), flavor="lxml", converters={i: str for i in range(len(df.columns))},
+                           keep_default_na=False, na_values=[], thousands=None)[0]
+        tables.append((df, raw.astype(str)))
+    return tables
+
+
+def _fetch_text(url, timeout):
+    """GET url, giving up once timeout seconds have passed in total (not just between reads)."""
+    import requests
+
+    deadline = time.monotonic() + timeout
+    with requests.get(url, timeout=timeout, stream=True, headers={"User-Agent": "Mozilla/5.0 (Adras)"}) as resp:
+        resp.raise_for_status()
+        # read1 returns whatever has arrived instead of waiting for a full chunk (urllib3 >= 2.3)
+        read = getattr(resp.raw, "read1", None) or resp.raw.read
+        chunks = []
+        while True:
+            chunk = read(64 * 1024, decode_content=True)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"took longer than {timeout:.0f}s")
+        return b"".join(chunks).decode(resp.encoding or "utf-8", errors="replace")
+
+
+def materialize_html_tables(urls, req_dir, budget=None, max_tables_per_url=MAX_HTML_TABLES):
+    """
+    Fetch each URL once, save the page under pages/ and every table on it under
+    tables/ as two columnar files: the parsed table (pandas.read_html types,
+    headers flattened to strings) and the raw cells as the exact text on the
+    page ("007" stays "007", "1.50" stays "1.50"). A manifest with
+    paths, original header levels, shapes and sample rows is written to
+    tables/manifest.json and returned. Fetching shares FETCH_TIME_FRACTION of
+    the budget's time left; each URL gets an even split of what remains, at
+    most FETCH_TIMEOUT seconds.
+    """
+    share = (budget or RequestBudget()).sub_budget(FETCH_TIME_FRACTION)
+
+    pages_dir = os.path.join(req_dir, "pages")
+    tables_dir = os.path.join(req_dir, "tables")
+    os.makedirs(pages_dir, exist_ok=True)
+    os.makedirs(tables_dir, exist_ok=True)
+
+    manifest = {"pages": [], "tables": [], "errors": []}
+    for i, url in enumerate(urls):
+        timeout = min(FETCH_TIMEOUT, share.remaining() / (len(urls) - i))
+        if timeout < 1:
+            manifest["errors"].append({"url": url, "error": "not fetched: no time left in the request budget"})
+            continue
+        try:
+            html = _fetch_text(url, timeout)
+        except Exception as e:
+            manifest["errors"].append({"url": url, "error": f"fetch failed: {e}"})
+            continue
+        page_path = os.path.join(pages_dir, f"page_{i}.html")
+        with open(page_path, "w", encoding="utf-8") as f:
+            f.write(html)
+        manifest["pages"].append({"url": url, "path": page_path})
+
+        try:
+            tables = _html_tables(html)
+        except Exception as e:
+            manifest["errors"].append({"url": url, "error": str(e)})
+            continue
+        if not tables:
+            manifest["errors"].append({"url": url, "error": "No tables found"})
+            continue
+
+        for k, (df, raw_df) in enumerate(tables[:max_tables_per_url]):
+            header_levels = [list(c) if isinstance(c, tuple) else [c] for c in df.columns]
+            df.columns = _dedupe([_flatten_header(c) for c in df.columns])
+            raw_df.columns = df.columns
+            stem = os.path.join(tables_dir, f"page{i}_table{k}")
+            manifest["tables"].append({
+                "url": url,
+                "table_index": k,
+                "path": write_columnar(df, stem),
+                "raw_path": write_columnar(raw_df, stem + "_raw"),
+                "columns": list(df.columns),
+                "header_levels": [[str(level) for level in levels] for levels in header_levels],
+                "dtypes": df.dtypes.astype(str).to_dict(),
+                "num_rows": len(df),
+                "num_cols": len(df.columns),
+                "sample_rows": json.loads(df.head(3).to_json(orient="records", date_format="iso")),
+            })
+        if len(tables) > max_tables_per_url:
+            manifest["errors"].append({"url": url, "error": f"only the first {max_tables_per_url} of {len(tables)} tables were saved"})
+
+    with open(os.path.join(tables_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+    return manifest
@@ -0,0 +1,518 @@
+"""
+Concurrent load test for the /api/ endpoint.
+
+Starts three local pieces and drives the API with them:
+    - a fake LLM endpoint (Groq-compatible /openai/v1/chat/completions) with
+      tunable latency, which classifies, generates and checks code so every
+      request runs the real lane loop without calling Groq;
+    - a fixture server with an HTML page of tables and a CSV dataset, used by
+      web and external requests;
+    - the API itself under uvicorn (or an already running server via --url).
+
+Requests are a weighted mix of file (synthetic CSV upload), web and external
+questions. Each concurrency level runs either closed-loop (N clients back to
+back) or open-loop with Poisson arrivals at --rate requests/s and at most N in
+flight. For every level it reports throughput, p50/p95/p99 latency, error
+rate, and the peak RSS and open file descriptors of the server process tree.
+Results are written as JSON; --compare prints the change against an earlier
+run, e.g. the previous release.
+
+Usage:
+    python load_test.py [--concurrency 1 4 16] [--duration 30] [--rate 2]
+                        [--mix file=0.5,web=0.3,external=0.2] [--llm-latency 0.5]
+                        [--out load_test.json] [--compare previous.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import requests
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+LANES = ("file", "web", "external")
+SAMPLE_INTERVAL = 0.2
+
+FIXTURE_HTML = """<html><body>
+<h1>Load test fixture</h1>
+<table>
+<thead><tr><th>Rank</th><th>Name</th><th>Value ($)</th></tr></thead>
+<tbody>{rows}</tbody>
+</table>
+<table>
+<tr><th>Region</th><th>Count</th></tr>
+<tr><td>North</td><td>12</td></tr><tr><td>South</td><td>7</td></tr>
+</table>
+</body></html>
+"""
+
+QUESTIONS = {
+    "file": "Using the uploaded data.csv, answer the following and return a JSON object:\n"
+            "1. How many rows are there?\n2. What is the mean of the value column?",
+    "web": "Scrape the table at {base}/table.html and answer, returning a JSON object:\n"
+           "1. How many rows does the first table have?\n2. What is the largest Value?",
+    "external": "Query the public dataset hosted at {base}/dataset.csv (no upload, no scraping) "
+                "and return a JSON object with the number of rows and the mean value.",
+}
+
+
+# --- fake LLM ---------------------------------------------------------------
+
+def _system_and_user(messages):
+    system = next((m.get("content") or "" for m in messages if m.get("role") == "system"), "")
+    user = "\n".join(m.get("content") or "" for m in messages if m.get("role") == "user")
+    return system, user
+
+
+def fake_completion(messages):
+    """Answer like the real models would for each kind of prompt the lanes send."""
+    system, user = _system_and_user(messages)
+    if "task classifier" in system:
+        if "dataset.csv" in user:
+            return json.dumps({"lane": "external_data"})
+        return json.dumps({"lane": "web" if "http" in user else "file"})
+    if "binary task checker" in system:
+        return "yes"
+    if "exact format requested" in system:
+        return json.dumps({"answer": 0})
+
+    # Code generators: read whatever data the prompt points at and print JSON
+    table = re.search(r'"path": "([^"]+/tables/page\d+_table\d+\.(?:parquet|pkl))"', user)
+    dataset = re.search(r"(https?://\S+/dataset\.csv)", user)
+    page = re.search(r"(https?://\S+\.html)", user)
+    if table:
+        reader = "read_parquet" if table.group(1).endswith(".parquet") else "read_pickle"
+        load = f"df = pd.{reader}({table.group(1)!r})"
+    elif dataset:
+        load = f"from block_cache import open_url\ndf = pd.read_csv(open_url({dataset.group(1)!r}))"
+    elif page:
+        load = f"df = pd.read_html({page.group(1)!r})[0]"
+    else:
+        load = "import glob\ndf = pd.read_csv(sorted(glob.glob('files/*.csv'))[0])"
+    return (
+        "import json\nimport pandas as pd\n"
+        f"{load}\n"
+        "final_output = {'rows': int(len(df)), 'mean': float(df.select_dtypes('number').mean().mean())}\n"
+        "print(json.dumps(final_output))"
+    )
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    latency = 0.5
+    jitter = 0.0
+    calls = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        delay = max(0.0, random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+        time.sleep(delay)
+        with FakeLLMHandler.lock:
+            FakeLLMHandler.calls += 1
+        content = fake_completion(body.get("messages", []))
+        payload = json.dumps({
+            "id": f"chatcmpl-loadtest-{FakeLLMHandler.calls}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(handler, directory=None):
+    if directory:
+        handler = _bind_directory(handler, directory)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _bind_directory(handler, directory):
+    class Bound(handler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=directory, **kwargs)
+    return Bound
+
+
+# --- fixtures ---------------------------------------------------------------
+
+def synthetic_csv(rows, seed=0):
+    rng = random.Random(seed)
+    lines = ["id,category,value,ts"]
+    for i in range(rows):
+        lines.append(f"{i},cat_{rng.randint(0, 19):02d},{rng.random() * 1000:.3f},"
+                     f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+def write_fixtures(directory, rows):
+    table_rows = "".join(f"<tr><td>{i}</td><td>Item {i}</td><td>{i * 37 % 1000:,}</td></tr>" for i in range(1, 51))
+    with open(os.path.join(directory, "table.html"), "w") as f:
+        f.write(FIXTURE_HTML.format(rows=table_rows))
+    with open(os.path.join(directory, "dataset.csv"), "wb") as f:
+        f.write(synthetic_csv(rows, seed=1))
+
+
+def build_request(lane, fixture_base, csv_bytes):
+    files = {"questions.txt": ("questions.txt", QUESTIONS[lane].format(base=fixture_base).encode())}
+    if lane == "file":
+        files["data.csv"] = ("data.csv", csv_bytes)
+    return files
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        lane, _, weight = part.partition("=")
+        lane = lane.strip()
+        if lane not in LANES:
+            raise argparse.ArgumentTypeError(f"unknown lane '{lane}' (expected one of {', '.join(LANES)})")
+        mix[lane] = float(weight or 1)
+    return mix
+
+
+# --- server under test ------------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_api(llm_base, log_path):
+    port = free_port()
+    env = dict(os.environ, GROQ_BASE_URL=llm_base, GROQ_API_KEY=os.getenv("GROQ_API_KEY") or "load-test")
+    log = open(log_path, "w")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"API exited with code {proc.returncode}; see {log_path}")
+        try:
+            if requests.get(f"{url}/health", timeout=1).ok:
+                return proc, url
+        except requests.RequestException:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError(f"API did not become healthy within 60s; see {log_path}")
+
+
+def _children():
+    """Map of pid -> child pids for every process visible in /proc."""
+    tree = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                # the command name may contain spaces; ppid is the 2nd field after ')'
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        tree.setdefault(ppid, []).append(int(name))
+    return tree
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _open_fds(pid):
+    try:
+        return len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        return 0
+
+
+class ResourceSampler:
+    """Samples RSS and open fds of a process and its descendants (lane subprocesses) until stopped."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.peak = {"rss": 0, "tree_rss": 0, "fds": 0, "tree_fds": 0, "tree_processes": 0}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        tree = _children()
+        pids, stack = [], [self.pid]
+        while stack:
+            pid = stack.pop()
+            pids.append(pid)
+            stack.extend(tree.get(pid, []))
+        sample = {
+            "rss": _rss_bytes(self.pid),
+            "tree_rss": sum(_rss_bytes(p) for p in pids),
+            "fds": _open_fds(self.pid),
+            "tree_fds": sum(_open_fds(p) for p in pids),
+            "tree_processes": len(pids),
+        }
+        for key, value in sample.items():
+            self.peak[key] = max(self.peak[key], value)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        if self.pid and os.path.isdir(f"/proc/{self.pid}"):
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+# --- load generation --------------------------------------------------------
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return round(sorted_values[index], 3)
+
+
+def latency_summary(latencies):
+    values = sorted(latencies)
+    return {
+        "p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99),
+        "mean": round(sum(values) / len(values), 3) if values else None,
+        "max": round(values[-1], 3) if values else None,
+    }
+
+
+def send(url, lane, fixture_base, csv_bytes, timeout, deadline):
+    headers = {"X-Adras-Deadline": str(deadline)} if deadline else {}
+    started = time.perf_counter()
+    try:
+        resp = requests.post(f"{url}/api/", files=build_request(lane, fixture_base, csv_bytes),
+                             headers=headers, timeout=timeout)
+        error = None if resp.status_code == 200 else f"HTTP {resp.status_code}"
+    except requests.RequestException as e:
+        error = type(e).__name__
+    return {"lane": lane, "latency": time.perf_counter() - started, "error": error}
+
+
+def run_level(url, concurrency, args, fixture_base, csv_bytes, pid):
+    """Drive the API at one concurrency level for args.duration seconds."""
+    lanes, weights = zip(*args.mix.items())
+    rng = random.Random(args.seed + concurrency)
+    results, lock = [], threading.Lock()
+    stop_at = time.monotonic() + args.duration
+
+    def one(lane, scheduled=None):
+        result = send(url, lane, fixture_base, csv_bytes, args.timeout, args.deadline)
+        if scheduled is not None:
+            # Open loop: latency counts from the arrival time, so queueing shows up
+            result["latency"] = time.perf_counter() - scheduled
+        with lock:
+            results.append(result)
+
+    def closed_loop_client():
+        while time.monotonic() < stop_at:
+            one(rng.choices(lanes, weights)[0])
+
+    metrics_before = _server_metrics(url)
+    started = time.perf_counter()
+    with ResourceSampler(pid) as sampler, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        if args.rate:
+            next_arrival = time.perf_counter()
+            while time.monotonic() < stop_at:
+                next_arrival += rng.expovariate(args.rate)
+                time.sleep(max(0.0, next_arrival - time.perf_counter()))
+                pool.submit(one, rng.choices(lanes, weights)[0], next_arrival)
+        else:
+            for _ in range(concurrency):
+                pool.submit(closed_loop_client)
+    elapsed = time.perf_counter() - started
+    metrics_after = _server_metrics(url)
+
+    errors = [r for r in results if r["error"]]
+    by_lane = {}
+    for lane in lanes:
+        lane_results = [r for r in results if r["lane"] == lane]
+        by_lane[lane] = {
+            "requests": len(lane_results),
+            "errors": sum(1 for r in lane_results if r["error"]),
+            **latency_summary([r["latency"] for r in lane_results if not r["error"]]),
+        }
+    level = {
+        "concurrency": concurrency,
+        "rate": args.rate or None,
+        "seconds": round(elapsed, 2),
+        "requests": len(results),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(results), 4) if results else None,
+        "error_kinds": {k: sum(1 for r in errors if r["error"] == k) for k in sorted({r["error"] for r in errors})},
+        "throughput_rps": round((len(results) - len(errors)) / elapsed, 3) if elapsed else None,
+        "latency_s": latency_summary([r["latency"] for r in results if not r["error"]]),
+        "by_lane": by_lane,
+        "peak_rss_mb": round(sampler.peak["rss"] / 1024 ** 2, 1),
+        "peak_tree_rss_mb": round(sampler.peak["tree_rss"] / 1024 ** 2, 1),
+        "peak_open_fds": sampler.peak["fds"],
+        "peak_tree_open_fds": sampler.peak["tree_fds"],
+        "peak_tree_processes": sampler.peak["tree_processes"],
+    }
+    if metrics_before and metrics_after:
+        before, after = metrics_before["budget"], metrics_after["budget"]
+        level["server_fallbacks"] = after["fallbacks"] - before["fallbacks"]
+        level["server_deadline_missed"] = after["deadline_missed"] - before["deadline_missed"]
+    return level
+
+
+def _server_metrics(url):
+    try:
+        return requests.get(f"{url}/metrics", timeout=10).json()
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=APP_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(current, previous_path):
+    """Print per-level deltas against an earlier results file."""
+    with open(previous_path) as f:
+        previous = json.load(f)
+    old_levels = {level["concurrency"]: level for level in previous.get("levels", [])}
+    print(f"\nCompared with {previous_path} ({previous.get('meta', {}).get('revision')}):")
+    for level in current["levels"]:
+        old = old_levels.get(level["concurrency"])
+        if not old:
+            continue
+        parts = []
+        for label, new_value, old_value in (
+            ("throughput_rps", level["throughput_rps"], old["throughput_rps"]),
+            ("p95_s", level["latency_s"]["p95"], old["latency_s"]["p95"]),
+            ("p99_s", level["latency_s"]["p99"], old["latency_s"]["p99"]),
+            ("error_rate", level["error_rate"], old["error_rate"]),
+            ("peak_tree_rss_mb", level["peak_tree_rss_mb"], old["peak_tree_rss_mb"]),
+            ("peak_open_fds", level["peak_open_fds"], old["peak_open_fds"]),
+        ):
+            if new_value is None or old_value is None:
+                continue
+            change = f" ({(new_value - old_value) / old_value:+.0%})" if old_value else ""
+            parts.append(f"{label} {old_value} -> {new_value}{change}")
+        print(f"  concurrency {level['concurrency']}: " + ", ".join(parts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="in-flight request limits to test")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per concurrency level")
+    parser.add_argument("--rate", type=float, default=0, help="open-loop Poisson arrivals per second (0: closed loop)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("file=0.5,web=0.3,external=0.2"),
+                        help="lane weights, e.g. file=0.5,web=0.3,external=0.2")
+    parser.add_argument("--csv-rows", type=int, default=20000, help="rows in the synthetic CSV upload and dataset")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="mean fake LLM response time in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="standard deviation of the fake LLM latency")
+    parser.add_argument("--deadline", type=float, default=None, help="X-Adras-Deadline sent with each request")
+    parser.add_argument("--timeout", type=float, default=300, help="client timeout per request in seconds")
+    parser.add_argument("--url", default=None, help="test an already running API instead of starting one "
+                                                    "(it must use the fake LLM printed at startup via GROQ_BASE_URL)")
+    parser.add_argument("--pid", type=int, default=None, help="pid of the --url server, for RSS/fd sampling")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="load_test.json", help="where to write the JSON results")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    fixture_dir = tempfile.mkdtemp(prefix="adras_load_")
+    write_fixtures(fixture_dir, args.csv_rows)
+    csv_bytes = synthetic_csv(args.csv_rows)
+
+    FakeLLMHandler.latency, FakeLLMHandler.jitter = args.llm_latency, args.llm_jitter
+    llm_server, llm_base = serve(FakeLLMHandler)
+    fixture_server, fixture_base = serve(FixtureHandler, directory=fixture_dir)
+    print(f"Fake LLM on {llm_base}, fixtures on {fixture_base}", flush=True)
+
+    proc = None
+    if args.url:
+        url, pid = args.url.rstrip("/"), args.pid
+    else:
+        proc, url = start_api(llm_base, os.path.join(fixture_dir, "api.log"))
+        pid = proc.pid
+        print(f"API on {url} (pid {pid}, log {fixture_dir}/api.log)", flush=True)
+
+    levels = []
+    try:
+        for concurrency in args.concurrency:
+            level = run_level(url, concurrency, args, fixture_base, csv_bytes, pid)
+            levels.append(level)
+            print(json.dumps({k: level[k] for k in ("concurrency", "requests", "throughput_rps", "latency_s",
+                                                    "error_rate", "peak_tree_rss_mb", "peak_open_fds")}), flush=True)
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=30)
+        llm_server.shutdown()
+        fixture_server.shutdown()
+
+    results = {
+        "meta": {
+            "revision": _git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "duration_s": args.duration,
+            "rate": args.rate or None,
+            "mix": args.mix,
+            "csv_rows": args.csv_rows,
+            "llm_latency_s": args.llm_latency,
+            "llm_jitter_s": args.llm_jitter,
+            "llm_calls": FakeLLMHandler.calls,
+        },
+        "levels": levels,
+    }
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.out}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
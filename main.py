@@ -1,21 +1,83 @@
-from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 from typing import Dict
+import asyncio
+import importlib
 import os
+import sys
 import uuid
-from web_pipeline import fail_proof
+import workspace
+import block_cache
+import scheduler
+import preflight
+from settings import settings, get_client
 
 # Import functions
 from splitter import classify_from_req_id
 
-# Import web_pipeline for web lane
-from web_pipeline import web_pipeline
-from file_pipeline import file_pipeline
-from external_pipeline import external_pipeline
+# Lanes (and pandas behind them) are imported on first use, or warmed in the
+# background once the server is up, so worker boot stays cheap.
+LANES = {
+    "file": ("file_pipeline", "file_pipeline"),
+    "web": ("web_pipeline", "web_pipeline"),
+    "external": ("external_pipeline", "external_pipeline"),
+    "mixed": ("mixed_pipeline", "mixed_pipeline"),
+}
+
+def load_lane(name):
+    module_name, func_name = LANES[name]
+    return getattr(importlib.import_module(module_name), func_name)
+
+def run_lane(name, req_id, budget):
+    budget.lane = name
+    try:
+        result = load_lane(name)(req_id, budget=budget)
+    except Exception:
+        budget.finish("error")
+        raise
+    budget.finish()
+    return result
+
+def warm_lanes():
+    for name in LANES:
+        try:
+            load_lane(name)
+        except Exception as e:
+            print(f"Failed to warm {name} lane: {e}")
+    try:
+        import pandas  # noqa: F401
+        get_client()
+    except Exception as e:
+        print(f"Failed to warm dependencies: {e}")
+
+async def sweep_workspaces_periodically():
+    while True:
+        await asyncio.sleep(workspace.SWEEP_INTERVAL_SECONDS)
+        try:
+            await asyncio.to_thread(workspace.sweep_orphans)
+        except Exception as e:
+            print(f"Workspace sweep failed: {e}")
+
+async def warm_after_startup():
+    # Give uvicorn time to bind the socket and answer health probes first
+    await asyncio.sleep(settings.warm_delay_seconds)
+    await asyncio.to_thread(warm_lanes)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Directories left behind by crashed workers are removed before serving
+    workspace.sweep_orphans()
+    tasks = [asyncio.create_task(sweep_workspaces_periodically())]
+    if settings.warm_lanes:
+        tasks.append(asyncio.create_task(warm_after_startup()))
+    yield
+    for task in tasks:
+        task.cancel()
 
 # Create the FastAPI app instance
-app = FastAPI(title="Adras Data Analyst Agent API", version="0.1.0")
+app = FastAPI(title="Adras Data Analyst Agent API", version="0.1.0", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  
@@ -29,12 +91,21 @@ app.add_middleware(
 async def health() -> Dict[str, str]:
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def metrics():
+    return {"workspace": workspace.usage(), "block_cache": block_cache.usage(), "budget": scheduler.usage(),
+            "preflight": preflight.usage(),
+            # decompose pulls in the file lane, so only report it once a lane has loaded it
+            "decompose": sys.modules["decompose"].usage() if "decompose" in sys.modules else None}
+
 @app.api_route("/", methods=["GET", "HEAD"])
 async def root():
     return {"message": "Adras API is running"}
 
 @app.post("/api/")
-async def analyze(request: Request, background_tasks: BackgroundTasks):
+async def analyze(request: Request):
+    # The deadline covers the whole request, including upload parsing and classification
+    budget = scheduler.RequestBudget(scheduler.deadline_from_headers(request.headers))
     form = await request.form()
 
     uploads = []
@@ -72,86 +143,95 @@ async def analyze(request: Request, background_tasks: BackgroundTasks):
         raise HTTPException(status_code=400, detail=f"Failed to read questions.txt: {e}")
 
     # Make temp dirs
-    temp_root = os.path.join(os.getcwd(), "temp")
-    os.makedirs(temp_root, exist_ok=True)
     req_id = str(uuid.uuid4())
-    req_dir = os.path.join(temp_root, req_id)
+    # Large uploads (already spooled to disk by the form parser) get a disk-backed workspace
+    upload_bytes = sum(v.size or 0 for v in uploads if v is not qfile)
+    req_dir = workspace.create_request_dir(req_id, upload_bytes=upload_bytes)
     images_dir = os.path.join(req_dir, "images")
     data_dir = os.path.join(req_dir, "files")
-    os.makedirs(images_dir, exist_ok=True)
-    os.makedirs(data_dir, exist_ok=True)
 
-    background_tasks.add_task(cleanup_temp_dir, req_dir)
-
-    # Save questions.txt
-    questions_path = os.path.join(req_dir, "questions.txt")
-    with open(questions_path, "wb") as f:
-        f.write(qbytes)
-
-    # Classify task
+    # Released on every exit, including HTTPException paths where background tasks never run
     try:
-        task_type = classify_from_req_id(req_id)
-        print(f"Task Type: {task_type}")
-    except Exception as e:
-        print(f"Error classifying task: {e}")
-        task_type = None
+        # Save questions.txt
+        questions_path = os.path.join(req_dir, "questions.txt")
+        with open(questions_path, "wb") as f:
+            f.write(qbytes)
 
-    images_saved = []
-    data_files_saved = []
-
-    # Save other uploads
-    for key in form.keys():
-        for v in form.getlist(key):
-            if hasattr(v, "filename") and hasattr(v, "read") and v is not qfile:
-                name = v.filename or key
-                ext = name.lower().rsplit('.', 1)[-1] if '.' in name else ''
-                content = await v.read()
-                if ext in {"png", "jpg", "jpeg"}:
-                    out_path = os.path.join(images_dir, name)
-                    with open(out_path, "wb") as f:
-                        f.write(content)
-                    images_saved.append(out_path)
-                elif ext in {"csv", "xls", "xlsx"}:
-                    out_path = os.path.join(data_dir, name)
-                    with open(out_path, "wb") as f:
-                        f.write(content)
-                    data_files_saved.append(out_path)
-
-
-    # 🚀 If this is a file-type task, immediately run file lane
-    if task_type and task_type.lower().startswith("file"):
-        try:
-            result = file_pipeline(req_id)
-            return JSONResponse(content=result)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"File pipeline failed: {e}")
-
-    # 🚀 If this is a web-type task, run web lane
-    if task_type and task_type.lower().startswith("web"):
+        # Classify task
         try:
-            result = web_pipeline(req_id)
-            return JSONResponse(content=result)
+            with budget.timed("llm"):
+                task_type = classify_from_req_id(req_id, timeout=budget.llm_timeout())
+            print(f"Task Type: {task_type}")
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Web pipeline failed: {e}")
-
-    # 🚀 If this is an external-type task, run external lane
-    if task_type and task_type.lower().startswith("external"):
-        try:
-            result = external_pipeline(req_id)
-            return JSONResponse(content=result)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"External pipeline failed: {e}")
-
-    # Default fallback response (shouldn't normally reach if other lanes implemented)
-    stub = fail_proof("",questions_text)
-    return JSONResponse(content=stub)
+            print(f"Error classifying task: {e}")
+            task_type = None
+
+        images_saved = []
+        data_files_saved = []
+
+        # Save other uploads
+        for key in form.keys():
+            for v in form.getlist(key):
+                if hasattr(v, "filename") and hasattr(v, "read") and v is not qfile:
+                    name = v.filename or key
+                    ext = name.lower().rsplit('.', 1)[-1] if '.' in name else ''
+                    if ext in {"png", "jpg", "jpeg"}:
+                        out_path, saved = os.path.join(images_dir, name), images_saved
+                    elif ext in {"csv", "xls", "xlsx"}:
+                        out_path, saved = os.path.join(data_dir, name), data_files_saved
+                    else:
+                        continue
+                    # Streamed in chunks off the event loop; multi-GB CSVs never sit in memory
+                    try:
+                        await asyncio.to_thread(workspace.save_upload, v.file, out_path, req_dir)
+                    except workspace.WorkspaceQuotaExceeded as e:
+                        raise HTTPException(status_code=413, detail=f"Upload too large: {e}")
+                    saved.append(out_path)
+
+
+        # 🚀 If this is a file-type task, immediately run file lane
+        if task_type and task_type.lower().startswith("file"):
+            try:
+                result = run_lane("file", req_id, budget)
+                return JSONResponse(content=result)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"File pipeline failed: {e}")
+
+        # 🚀 If this is a web-type task, run web lane
+        if task_type and task_type.lower().startswith("web"):
+            try:
+                result = run_lane("web", req_id, budget)
+                return JSONResponse(content=result)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Web pipeline failed: {e}")
+
+        # 🚀 If this is a mixed task (web pages + uploaded files), run mixed lane
+        if task_type and task_type.lower().startswith("mixed"):
+            try:
+                result = run_lane("mixed", req_id, budget)
+                return JSONResponse(content=result)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Mixed pipeline failed: {e}")
+
+        # 🚀 If this is an external-type task, run external lane
+        if task_type and task_type.lower().startswith("external"):
+            try:
+                result = run_lane("external", req_id, budget)
+                return JSONResponse(content=result)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"External pipeline failed: {e}")
+
+        # Default fallback response (shouldn't normally reach if other lanes implemented)
+        from web_pipeline import fail_proof
+        stub = fail_proof("",questions_text, timeout=budget.llm_timeout(fallback=True))
+        budget.lane = task_type or "other"
+        budget.finish("fallback")
+        return JSONResponse(content=stub)
+    finally:
+        await asyncio.to_thread(cleanup_temp_dir, req_dir)
 
 def cleanup_temp_dir(req_dir):
-    import shutil
-    try:
-        shutil.rmtree(req_dir)
-    except Exception as e:
-        print(f"Failed to delete temp dir {req_dir}: {e}")
+    workspace.release_request_dir(req_dir)
 
 
 
@@ -0,0 +1,67 @@
+import os
+import json
+from io import open as io_open
+from concurrent.futures import ThreadPoolExecutor
+from web_pipeline import extract_urls, stage_tables
+from file_pipeline import probe_files, iterate_in_reqdir
+from workspace import request_dir
+from settings import settings
+
+system_prompt = """
+You are Adras, an autonomous AI data analyst.
+
+You will be given a user question, metadata for uploaded files and metadata for web pages the question refers to.
+
+You must:
+    •	Solve complex natural language queries that combine uploaded files with data from web pages.
+    •	Uploaded files are in the 'files' folder; Excel sheets have already been converted, so load them from their 'columnar_path' (pd.read_parquet, or pd.read_pickle for .pkl).
+    •	Tables on the web pages have already been parsed and saved; load them from the table manifest 'path' with pd.read_parquet (pd.read_pickle for .pkl) instead of fetching the URL. 'raw_path' has the same table with every cell as original text. The pages themselves are saved under 'pages' if a table you need is not in the manifest.
+    •	Use only standard Python libraries (pandas, requests, matplotlib, seaborn, duckdb, etc.).
+    •	For scraped tables, never assume column names or structure. If numeric values contain footnotes or symbols (like $, ,, [1]), clean them using regular expressions before type conversion.
+    •	If a specific format (e.g. JSON array, base64 plot) is requested, format output accordingly.
+    •	Return only the Python code, with no explanation or markdown formatting.
+    •	When working with large datasets, never load the entire dataset into memory. Only load the necessary columns or rows.
+    •	Always end your code with: import json; print(json.dumps(final_output)), where final_output is the answer in the requested format.
+"""
+
+def mixed_pipeline(req_id, budget=None):
+    base_path = request_dir(req_id)
+    question_path = os.path.join(base_path, "questions.txt")
+    files_path = os.path.join(base_path, "files")
+
+    if not os.path.exists(question_path):
+        raise FileNotFoundError(f"questions.txt not found for req {req_id}")
+
+    with io_open(question_path, "r", encoding="utf-8") as f:
+        question = f.read().strip()
+
+    urls = extract_urls(question)
+
+    # Web staging (download + table metadata) and file probing are independent,
+    # so staging takes as long as the slower side rather than both added up.
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        web_future = pool.submit(stage_tables, urls, base_path, budget)
+        file_future = pool.submit(probe_files, files_path) if os.path.isdir(files_path) else None
+        web_context = web_future.result()
+        file_context = file_future.result() if file_future else []
+
+    context = {
+        "question": question,
+        "file_metadata": file_context,
+        "table_manifest": web_context["tables"],
+        "pages": web_context["pages"],
+        "staging_errors": web_context["errors"],
+        "table_metadata": web_context["table_metadata"],
+    }
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": json.dumps(context, indent=2, default=str)}
+    ]
+    metadata = {"files": file_context, "tables": web_context["tables"], "scraped": web_context["table_metadata"]}
+    if settings.decompose_questions:
+        from decompose import solve_in_parts
+        context = json.dumps({k: v for k, v in context.items() if k != "question"}, indent=2, default=str)
+        result = solve_in_parts(question, system_prompt, context, base_path, metadata=metadata, budget=budget)
+        if result is not None:
+            return result
+    return iterate_in_reqdir(messages, question, base_path, budget=budget, metadata=metadata)
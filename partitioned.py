@@ -0,0 +1,134 @@
+import os
+import json
+from settings import settings
+from file_pipeline import iterate_in_reqdir, run_code_in_reqdir
+from preflight import MAP_REDUCE
+
+RUNNER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "partition_runner.py")
+
+# pandas needs several times the CSV's on-disk size once parsed
+PANDAS_EXPANSION = 5
+MEMORY_FRACTION = 0.5
+MIN_PARTITION_BYTES = 16 * 1024 * 1024
+MAX_PARTITION_BYTES = 1024 * 1024 * 1024
+# Scanning multi-GB inputs takes longer than a normal step; the request budget still applies
+MAX_STEP_TIMEOUT = 900
+
+system_prompt = """
+You are Adras, an autonomous data analyst working on a CSV that is too large to load into memory.
+
+The CSV is split into row partitions that are processed in parallel worker processes. You will be given the question, the CSV structure metadata (columns, dtypes, sample rows) and the partition plan.
+
+Return only Python code (no explanations, no markdown) for a module that DEFINES, and does not call:
+    •	READ_CSV_KWARGS = {...}  (optional) keyword arguments for pandas.read_csv for every partition. Use "usecols" to read only the columns you need and "dtype" to keep memory low.
+    •	def map_partition(df, info): computes a small, picklable partial result (numbers, dicts, or a small aggregated DataFrame) from one partition. info has "file", "partition" and "num_partitions".
+    •	def reduce_partials(partials): combines the list of partials (in file order) into final_output, the answer in the requested format, and returns it.
+
+Rules:
+    •	Never read the whole large CSV yourself; only work on the df passed to map_partition. Other small files in 'files' may be read normally.
+    •	Partials must be mergeable: for means return sums and counts, for medians/quantiles return value counts or sorted samples, for top-k return per-partition top-k.
+    •	Do not print anything; the runner prints json.dumps(reduce_partials(...)).
+    •	If a plot is requested, build it inside reduce_partials from the combined data and return it base64-encoded in final_output.
+"""
+
+
+def available_memory():
+    """Bytes of memory available to new allocations (MemAvailable on Linux)."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return 2 * 1024 * 1024 * 1024
+
+
+def partition_threshold():
+    """CSVs larger than this are processed in partitions: the size whose parsed frame would outgrow MEMORY_FRACTION of available memory."""
+    return settings.partition_threshold_bytes or int(available_memory() * MEMORY_FRACTION / PANDAS_EXPANSION)
+
+
+def choose_partition_bytes(workers, memory=None):
+    """Size partitions so that every worker's parsed partition fits in its share of available memory."""
+    memory = memory or available_memory()
+    size = int(memory * MEMORY_FRACTION / max(1, workers) / PANDAS_EXPANSION)
+    return max(MIN_PARTITION_BYTES, min(MAX_PARTITION_BYTES, size))
+
+
+def plan_partitions(csv_path, partition_bytes, workers):
+    """
+    Split csv_path into byte ranges of about partition_bytes, each ending on a
+    newline so every range holds whole rows. Quoted fields containing
+    newlines are not supported.
+    """
+    size = os.path.getsize(csv_path)
+    with open(csv_path, "rb") as f:
+        header = f.readline()
+        start = f.tell()
+        partitions = []
+        while start < size:
+            target = start + partition_bytes
+            if target >= size:
+                end = size
+            else:
+                f.seek(target)
+                f.readline()
+                end = f.tell()
+            partitions.append([start, end])
+            start = end
+    return {
+        "file": os.path.basename(csv_path),
+        "path": os.path.abspath(csv_path),
+        "header": header.decode("utf-8", errors="replace"),
+        "size_bytes": size,
+        "partition_bytes": partition_bytes,
+        "partitions": partitions,
+        "workers": workers,
+    }
+
+
+def find_large_csv(files_path):
+    """Return the path of the largest CSV in files_path if it is over the partition threshold, else None."""
+    csvs = [os.path.join(files_path, f) for f in os.listdir(files_path) if f.lower().endswith(".csv")]
+    if not csvs:
+        return None
+    largest = max(csvs, key=os.path.getsize)
+    return largest if os.path.getsize(largest) > partition_threshold() else None
+
+
+def partitioned_pipeline(question, structure_list, csv_path, base_path, budget=None):
+    structure_str = json.dumps(structure_list, indent=2)
+    workers = settings.partition_workers
+    plan = plan_partitions(csv_path, choose_partition_bytes(workers), workers)
+    plan_path = os.path.join(base_path, "partition_plan.json")
+    with open(plan_path, "w") as f:
+        json.dump(plan, f)
+    print(f"Partitioned mode: {plan['file']} ({plan['size_bytes']} bytes) in "
+          f"{len(plan['partitions'])} partitions of ~{plan['partition_bytes']} bytes, {workers} workers")
+
+    plan_summary = {k: plan[k] for k in ("file", "size_bytes", "partition_bytes", "workers")}
+    plan_summary["num_partitions"] = len(plan["partitions"])
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": (
+            f"Question:\n{question}\n\nFile structure metadata:\n{structure_str}\n\n"
+            f"Partition plan:\n{json.dumps(plan_summary, indent=2)}"
+        )}
+    ]
+
+    def run(code, req_dir, timeout):
+        stdout, stderr = run_code_in_reqdir(code, req_dir, timeout=timeout, runner=RUNNER_PATH, runner_args=(plan_path,))
+        # Runner timing goes to the server log, not to the checker
+        log_path = os.path.join(req_dir, "partition_runner.log")
+        if os.path.exists(log_path):
+            with open(log_path) as f:
+                print(f"Partition runner: {f.read().strip()}")
+            os.remove(log_path)
+        return stdout, stderr
+
+    return iterate_in_reqdir(messages, question, base_path, budget=budget, max_timeout=MAX_STEP_TIMEOUT, run=run,
+                             metadata=structure_list, contract=MAP_REDUCE)
@@ -0,0 +1,356 @@
+"""
+Static pre-flight checks for generated code, shared by all lanes.
+
+Catches failures that are visible without running anything: syntax errors,
+disallowed or missing imports and a missing final JSON print (or map/reduce
+functions in partitioned mode). Rejected code is never executed and never
+reaches the checker LLM; the feedback goes straight back to the generator.
+
+References to columns that the probed schema says don't exist are only
+advisory (column_hints): static tracking can't see every way code builds its
+columns, so the code still runs and the hint is attached to its errors.
+"""
+import ast
+import re
+import difflib
+import importlib.util
+import threading
+
+PRINT_JSON = "print_json"   # must print json.dumps(...) / df.to_json() / json.dump(..., sys.stdout)
+PRINT_ANY = "print"         # must print something
+MAP_REDUCE = "map_reduce"   # must define map_partition() and reduce_partials()
+
+DISALLOWED_MODULES = {"subprocess", "ctypes", "pty", "tkinter"}
+
+# Methods that return a frame with the same columns, so the result is tracked like its source
+FRAME_PRESERVING_METHODS = {
+    "copy", "dropna", "fillna", "query", "head", "tail", "sort_values",
+    "drop_duplicates", "sample", "astype", "reset_index", "convert_dtypes",
+}
+COLUMN_ARG_METHODS = {"groupby", "sort_values", "drop_duplicates", "set_index", "pivot_table"}
+# Reader keywords that give the frame different column labels than the probe saw
+LABEL_CHANGING_KEYWORDS = {"names", "header", "skiprows", "index_col", "sheet_name"}
+EVAL_ASSIGNMENT = re.compile(r"^\s*([A-Za-z_]\w*)\s*=(?!=)", re.MULTILINE)
+
+_lock = threading.Lock()
+_stats = {"checked": 0, "rejected": 0, "executions_saved": 0, "checker_calls_saved": 0, "column_hints": 0}
+_spec_cache = {}
+
+
+def known_columns(metadata):
+    """Collect every column name listed under a "columns" key anywhere in the probe/scraper metadata."""
+    found = set()
+
+    def walk(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == "columns" and isinstance(value, list):
+                    found.update(str(c) for c in value if isinstance(c, (str, int, float)))
+                else:
+                    walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    walk(metadata)
+    return found
+
+
+def known_sources(metadata):
+    """File names, paths and URLs the metadata describes, used to tell probed data from other reads."""
+    found = set()
+
+    def walk(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key in ("file", "url", "path", "columnar_path") and isinstance(value, str):
+                    found.add(value)
+                else:
+                    walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    walk(metadata)
+    return found
+
+
+def _module_available(name):
+    if name not in _spec_cache:
+        try:
+            _spec_cache[name] = importlib.util.find_spec(name) is not None
+        except (ImportError, ValueError):
+            _spec_cache[name] = False
+    return _spec_cache[name]
+
+
+def _check_imports(tree):
+    issues = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            top = name.split(".")[0]
+            if top in DISALLOWED_MODULES:
+                issues.append(f"line {node.lineno}: importing '{top}' is not allowed.")
+            elif not _module_available(top):
+                issues.append(f"line {node.lineno}: module '{top}' is not installed; use pandas, numpy, duckdb, matplotlib, seaborn, requests or the standard library.")
+    return issues
+
+
+def _is_json_output(call):
+    func = call.func
+    if isinstance(func, ast.Attribute) and func.attr in ("dumps", "to_json"):
+        return True
+    return False
+
+
+def _check_contract(tree, contract):
+    if contract == MAP_REDUCE:
+        defined = {n.name for n in tree.body if isinstance(n, ast.FunctionDef)}
+        missing = [f for f in ("map_partition", "reduce_partials") if f not in defined]
+        return [f"the module must define {f}() at top level." for f in missing]
+
+    # out = json.dumps(result); print(out) is as good as printing it inline
+    json_names = {t.id for node in ast.walk(tree)
+                  if isinstance(node, ast.Assign) and isinstance(node.value, ast.Call) and _is_json_output(node.value)
+                  for t in node.targets if isinstance(t, ast.Name)}
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        func = node.func
+        is_print = isinstance(func, ast.Name) and func.id == "print"
+        is_write = isinstance(func, ast.Attribute) and func.attr == "write"
+        is_dump = isinstance(func, ast.Attribute) and func.attr == "dump" \
+            and isinstance(func.value, ast.Name) and func.value.id == "json"
+        if contract == PRINT_ANY and (is_print or is_write or is_dump):
+            return []
+        if is_dump:
+            return []
+        if (is_print or is_write) and any((isinstance(a, ast.Call) and _is_json_output(a))
+                                          or (isinstance(a, ast.Name) and a.id in json_names) for a in node.args):
+            return []
+    if contract == PRINT_ANY:
+        return ["the code never prints its result."]
+    return ["the code never prints the final answer; end with: import json; print(json.dumps(final_output))."]
+
+
+def _is_reader_call(node, sources=None):
+    """
+    A pandas read_* call. With sources, only reads of probed data count: a
+    literal path must name one of the sources; computed paths are assumed to.
+    """
+    if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+            and node.func.attr.startswith("read_")):
+        return False
+    if sources is None or not node.args:
+        return True
+    arg = node.args[0]
+    if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+        return any(s in arg.value or arg.value in s for s in sources)
+    return True
+
+
+def _probed_labels(call):
+    """False if the reader call's keywords (or **kwargs) may change the column labels."""
+    return not any(kw.arg is None or kw.arg in LABEL_CHANGING_KEYWORDS for kw in call.keywords)
+
+
+def _frame_expr(node, frames, frame_lists, sources=None):
+    """True if node evaluates to a DataFrame whose columns are those of the probed data."""
+    if _is_reader_call(node, sources):
+        return node.func.attr != "read_html" and _probed_labels(node)
+    if isinstance(node, ast.Name):
+        return node.id in frames
+    if isinstance(node, ast.Subscript):
+        value = node.value
+        # tables[0] where tables = pd.read_html(...), or pd.read_html(...)[0];
+        # scraped metadata only describes the first table
+        first = isinstance(node.slice, ast.Constant) and node.slice.value == 0
+        if (isinstance(value, ast.Name) and value.id in frame_lists) or \
+                (_is_reader_call(value, sources) and value.func.attr == "read_html"):
+            return first
+        # df[mask] keeps all columns; df["col"] / df[["a", "b"]] do not
+        if isinstance(node.slice, (ast.Constant, ast.List)):
+            return False
+        return _frame_expr(value, frames, frame_lists, sources)
+    if isinstance(node, ast.Attribute) and node.attr == "loc":
+        return _frame_expr(node.value, frames, frame_lists, sources)
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) \
+            and node.func.attr in FRAME_PRESERVING_METHODS:
+        return _frame_expr(node.func.value, frames, frame_lists, sources)
+    return False
+
+
+def _string_items(node):
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [(node.value, node.lineno)]
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [(e.value, e.lineno) for e in node.elts if isinstance(e, ast.Constant) and isinstance(e.value, str)]
+    return []
+
+
+def _assigned_labels(target):
+    """
+    Column labels created by assigning to df[...] / df.loc[..., ...], or None
+    when they are computed (df[col] = ...) and can't be read statically.
+    """
+    labels = target.slice
+    if isinstance(target.value, ast.Attribute) and target.value.attr in ("loc", "at"):
+        if not isinstance(labels, ast.Tuple) or len(labels.elts) < 2:
+            return []  # row assignment
+        labels = labels.elts[1]
+    if isinstance(labels, ast.Slice) or (isinstance(labels, ast.Constant) and not isinstance(labels.value, str)):
+        return []
+    items = _string_items(labels)
+    if isinstance(labels, ast.Constant) or (isinstance(labels, (ast.List, ast.Tuple)) and len(items) == len(labels.elts)):
+        return [name for name, _ in items]
+    return None
+
+
+def _subscript_base(target):
+    base = target.value
+    if isinstance(base, ast.Attribute) and base.attr in ("loc", "at"):
+        base = base.value
+    return base.id if isinstance(base, ast.Name) else None
+
+
+def _check_columns(tree, columns, sources):
+    frames, frame_lists = set(), set()
+    created = set()
+
+    # Which names hold probed frames; repeat until stable since ast.walk is not in source order
+    while True:
+        before = len(frames) + len(frame_lists)
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Assign):
+                continue
+            for target in node.targets:
+                if not isinstance(target, ast.Name):
+                    continue
+                if _is_reader_call(node.value, sources) and node.value.func.attr == "read_html":
+                    frame_lists.add(target.id)
+                elif _frame_expr(node.value, frames, frame_lists, sources):
+                    frames.add(target.id)
+        if len(frames) + len(frame_lists) == before:
+            break
+
+    # A name that is also assigned something else (df = df.pivot(...)) may hold other columns
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and not _frame_expr(node.value, frames, frame_lists, sources) \
+                and not _is_reader_call(node.value, sources):
+            frames.difference_update(t.id for t in node.targets if isinstance(t, ast.Name))
+
+    # Columns the code creates itself
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Attribute) and target.attr == "columns":
+                    return []  # columns renamed wholesale; names in the schema no longer apply
+                elif isinstance(target, ast.Subscript):
+                    labels = _assigned_labels(target)
+                    if labels is None:
+                        # for col in [...]: df[col] = ... creates columns we can't name
+                        frames.discard(_subscript_base(target))
+                    else:
+                        created.update(labels)
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            if node.func.attr == "assign":
+                created.update(kw.arg for kw in node.keywords if kw.arg)
+            elif node.func.attr == "eval" and node.args and isinstance(node.args[0], ast.Constant) \
+                    and isinstance(node.args[0].value, str):
+                created.update(EVAL_ASSIGNMENT.findall(node.args[0].value))
+            elif node.func.attr == "insert" and len(node.args) >= 2:
+                created.update(name for name, _ in _string_items(node.args[1]))
+            elif node.func.attr == "rename":
+                for kw in node.keywords:
+                    if kw.arg == "columns":
+                        if not isinstance(kw.value, ast.Dict):
+                            return []
+                        created.update(v.value for v in kw.value.values if isinstance(v, ast.Constant))
+            elif node.func.attr in ("reset_index", "melt", "stack"):
+                created.update(("index", "level_0", "variable", "value"))
+
+    allowed = columns | created
+    refs = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Subscript) and isinstance(node.ctx, ast.Load) \
+                and isinstance(node.value, ast.Name) and node.value.id in frames:
+            refs.extend(_string_items(node.slice))
+        elif isinstance(node, ast.Call):
+            if _is_reader_call(node, sources) and _probed_labels(node):
+                refs.extend(r for kw in node.keywords if kw.arg == "usecols" for r in _string_items(kw.value))
+            elif isinstance(node.func, ast.Attribute) and node.func.attr in COLUMN_ARG_METHODS \
+                    and _frame_expr(node.func.value, frames, frame_lists, sources):
+                args = node.args[:1] + [kw.value for kw in node.keywords if kw.arg in ("by", "subset", "keys", "index", "values")]
+                refs.extend(r for a in args for r in _string_items(a))
+
+    issues = []
+    for name, lineno in refs:
+        if name in allowed:
+            continue
+        hint = difflib.get_close_matches(name, sorted(columns), n=1)
+        suggestion = f" Did you mean '{hint[0]}'?" if hint else ""
+        issues.append(f"line {lineno}: column '{name}' does not exist in the data.{suggestion}")
+    if issues:
+        issues.append("Known columns: " + ", ".join(sorted(columns)))
+    return issues
+
+
+def check_code(code, contract=PRINT_JSON, has_checker=True):
+    """
+    Statically check generated code. Returns None if it may run, otherwise
+    feedback for the generator explaining what to fix.
+    """
+    issues = []
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        line = (e.text or "").strip()
+        issues.append(f"SyntaxError at line {e.lineno}: {e.msg}" + (f"\n    {line}" if line else ""))
+        tree = None
+
+    if tree is not None:
+        issues.extend(_check_imports(tree))
+        if contract:
+            issues.extend(_check_contract(tree, contract))
+
+    with _lock:
+        _stats["checked"] += 1
+        if issues:
+            _stats["rejected"] += 1
+            _stats["executions_saved"] += 1
+            if has_checker:
+                _stats["checker_calls_saved"] += 1
+    if not issues:
+        return None
+    print(f"Pre-flight rejected generated code ({len(issues)} issue(s)); not running it.")
+    return "Pre-flight check failed, the code was NOT run. Fix these problems:\n- " + "\n- ".join(issues)
+
+
+def column_hints(code, metadata):
+    """
+    Advisory check of the column names code uses against the probed schema.
+    Returns a note to attach to the step's errors, or "" if nothing looks off.
+    """
+    columns = known_columns(metadata) if metadata else set()
+    if not columns:
+        return ""
+    try:
+        issues = _check_columns(ast.parse(code), columns, known_sources(metadata))
+    except SyntaxError:
+        return ""
+    if not issues:
+        return ""
+    with _lock:
+        _stats["column_hints"] += 1
+    return "\nColumn check (may be wrong if the code builds its own columns):\n- " + "\n- ".join(issues)
+
+
+def usage() -> dict:
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,169 @@
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from settings import settings
+
+# Header a client can send to set the overall deadline of one request, in seconds
+DEADLINE_HEADER = "x-adras-deadline"
+
+# Latency guesses used until a request has observed its own
+PRIOR_SECONDS = {"llm": 8.0, "exec": 15.0, "check": 3.0}
+MIN_STEP_TIMEOUT = 5.0
+MIN_LLM_TIMEOUT = 1.0
+
+_lock = threading.Lock()
+_recent = deque(maxlen=100)
+_totals = {"requests": 0, "fallbacks": 0, "unverified": 0, "errors": 0, "deadline_missed": 0}
+
+
+def deadline_from_headers(headers) -> float:
+    """Overall deadline for a request: the X-Adras-Deadline header if valid, else the configured default."""
+    value = headers.get(DEADLINE_HEADER)
+    try:
+        seconds = float(value)
+        if seconds > 0:
+            return min(seconds, settings.max_request_deadline_seconds)
+    except (TypeError, ValueError):
+        pass
+    return settings.request_deadline_seconds
+
+
+class RequestBudget:
+    """
+    Time budget for one request. Lanes ask it whether another iteration fits
+    before the deadline and how long the next step may run; it learns from
+    the LLM and execution latencies it records, and always keeps enough time
+    in reserve for the fail_proof fallback.
+    """
+
+    def __init__(self, deadline_seconds=None, max_iterations=None):
+        self.deadline_seconds = deadline_seconds or settings.request_deadline_seconds
+        self.max_iterations = max_iterations or settings.max_iterations
+        self.started = time.monotonic()
+        self.deadline = self.started + self.deadline_seconds
+        self.lane = None
+        self.outcome = "ok"
+        self.iterations = 0
+        self._spent = {"llm": 0.0, "exec": 0.0, "check": 0.0}
+        self._samples = {"llm": 0, "exec": 0, "check": 0}
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def sub_budget(self, fraction, max_iterations=None):
+        """
+        A budget for a sub-task (e.g. scraping) that ends after `fraction` of
+        the time left. It has its own iteration count but shares latency stats.
+        """
+        sub = RequestBudget(max(0.001, self.remaining() * fraction), max_iterations or self.max_iterations)
+        sub._spent, sub._samples, sub._lock = self._spent, self._samples, self._lock
+        return sub
+
+    def record(self, kind, seconds):
+        with self._lock:
+            self._spent[kind] += seconds
+            self._samples[kind] += 1
+
+    @contextmanager
+    def timed(self, kind):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(kind, time.monotonic() - start)
+
+    def estimate(self, kind) -> float:
+        with self._lock:
+            if self._samples[kind]:
+                return self._spent[kind] / self._samples[kind]
+        return PRIOR_SECONDS[kind]
+
+    def reserve(self) -> float:
+        # One LLM call for fail_proof plus a safety margin for the response
+        return self.estimate("llm") + settings.deadline_margin_seconds
+
+    def can_iterate(self) -> bool:
+        """True if one more generate/run/check round still fits before the deadline."""
+        if self.iterations >= self.max_iterations:
+            return False
+        needed = self.estimate("llm") + self.estimate("check") + MIN_STEP_TIMEOUT
+        return self.remaining() - self.reserve() >= needed
+
+    def start_iteration(self) -> int:
+        with self._lock:
+            self.iterations += 1
+            return self.iterations
+
+    def llm_timeout(self, fallback=False) -> float:
+        """
+        Timeout for one LLM call: the time left before the fail_proof reserve,
+        or for the fail_proof call itself (fallback) before the response margin.
+        """
+        keep = settings.deadline_margin_seconds if fallback else self.reserve()
+        return max(MIN_LLM_TIMEOUT, self.remaining() - keep)
+
+    def step_timeout(self, cap) -> float:
+        """
+        Timeout for the step about to run: this iteration's share of the time
+        left, spread over as many further iterations as observed latency
+        suggests fit, never more than cap or the time remaining. Later steps
+        get shorter timeouts.
+        """
+        available = self.remaining() - self.reserve() - self.estimate("check")
+        if available <= MIN_STEP_TIMEOUT:
+            return max(0.0, min(MIN_STEP_TIMEOUT, self.remaining()))
+        per_iteration = self.estimate("llm") + self.estimate("exec") + self.estimate("check")
+        iterations_left = max(1, self.max_iterations - self.iterations + 1)
+        planned = max(1, min(iterations_left, int(available // per_iteration)))
+        share = max(available / planned, self.estimate("exec") * 1.5)
+        return max(MIN_STEP_TIMEOUT, min(cap, share, available))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            spent = {k: round(v, 2) for k, v in self._spent.items()}
+        elapsed = self.elapsed()
+        return {
+            "lane": self.lane,
+            "outcome": self.outcome,
+            "deadline_s": round(self.deadline_seconds, 1),
+            "elapsed_s": round(elapsed, 2),
+            "used_fraction": round(elapsed / self.deadline_seconds, 3) if self.deadline_seconds else None,
+            "iterations": self.iterations,
+            "spent_s": spent,
+        }
+
+    def finish(self, outcome=None):
+        if outcome:
+            self.outcome = outcome
+        snap = self.snapshot()
+        with _lock:
+            _recent.append(snap)
+            _totals["requests"] += 1
+            if self.outcome == "fallback":
+                _totals["fallbacks"] += 1
+            elif self.outcome == "unverified":
+                _totals["unverified"] += 1
+            elif self.outcome == "error":
+                _totals["errors"] += 1
+            if snap["elapsed_s"] > self.deadline_seconds:
+                _totals["deadline_missed"] += 1
+        return snap
+
+
+def usage() -> dict:
+    with _lock:
+        recent = list(_recent)
+        totals = dict(_totals)
+    used = sorted(r["used_fraction"] for r in recent if r["used_fraction"] is not None)
+    return {
+        "default_deadline_s": settings.request_deadline_seconds,
+        **totals,
+        "used_fraction_p50": used[len(used) // 2] if used else None,
+        "used_fraction_max": used[-1] if used else None,
+        "recent": recent[-20:],
+    }
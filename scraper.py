@@ -1,12 +1,8 @@
-from groq import Groq
-import os
 import json
-import subprocess
-from dotenv import load_dotenv
-
-load_dotenv()
-api_key = os.getenv("GROQ_API_KEY")
-client = Groq(api_key=api_key)
+from settings import get_client
+from scheduler import RequestBudget
+from workspace import run_step
+from preflight import check_code, PRINT_ANY
 
 system_prompt = """
 You are a web scraping specialist that extracts minimal table metadata from web pages.
@@ -38,8 +34,8 @@ Instructions:
 - Handle errors gracefully
 - Return only Python code, no explanations
 """
-def ask_llm(messages):
-    response = client.chat.completions.create(
+def ask_llm(messages, timeout=None):
+    response = get_client(timeout).chat.completions.create(
         messages=messages,
         model="llama-3.3-70b-versatile",
         temperature=0,
@@ -58,19 +54,14 @@ def extract_python_code(text):
             text = text[:-3]
     return text.strip()
 
-def run_code(code):
-    try:
-        result = subprocess.run(
-            ["python3", "-c", code],
-            capture_output=True,
-            text=True,
-            timeout=30  # Shorter timeout for scraping
-        )
-        return result.stdout, result.stderr
-    except Exception as e:
-        return "", str(e)
+# Shorter timeout for scraping; the budget may hand out less
+MAX_STEP_TIMEOUT = 30
 
-def scrape(url):
+def run_code(code, req_dir, timeout=MAX_STEP_TIMEOUT):
+    return run_step(["python3", "-c", code], req_dir, timeout)
+
+def scrape(url, req_dir, budget=None):
+    budget = budget or RequestBudget(max_iterations=5)
     scraping_task = f"""
 Extract minimal table metadata from this URL: {url}
 
@@ -91,15 +82,20 @@ Remember to:
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": scraping_task}
     ]
-    max_iterations = 5 
-    iteration = 0
-    while iteration < max_iterations:
-        iteration += 1
+    while budget.can_iterate():
+        iteration = budget.start_iteration()
         print(f"\n=== Iteration {iteration} ===")
-        raw_code = ask_llm(messages)
+        with budget.timed("llm"):
+            raw_code = ask_llm(messages, timeout=budget.llm_timeout())
         code = extract_python_code(raw_code)
         print(f"Generated scraping code:\n{code}")
-        stdout, stderr = run_code(code)
+        preflight_feedback = check_code(code, contract=PRINT_ANY, has_checker=False)
+        if preflight_feedback:
+            messages.append({"role": "assistant", "content": code})
+            messages.append({"role": "user", "content": preflight_feedback})
+            continue
+        with budget.timed("exec"):
+            stdout, stderr = run_code(code, req_dir, timeout=budget.step_timeout(MAX_STEP_TIMEOUT))
         if checker(stdout):
             print("Table metadata extracted successfully.")
             json_data = json.loads(stdout)
@@ -0,0 +1,78 @@
+import os
+import tempfile
+import threading
+from dotenv import load_dotenv
+
+# The only load_dotenv() in the app; every module reads config from `settings`.
+load_dotenv()
+
+
+class Settings:
+    def __init__(self):
+        self.groq_api_key = os.getenv("GROQ_API_KEY")
+        self.groq_base_url = os.getenv("GROQ_BASE_URL") or None
+
+        # Request workspaces (see workspace.py)
+        self.workspace_root = os.getenv("ADRAS_WORKSPACE_ROOT", "")
+        self.workspace_quota_bytes = int(float(os.getenv("ADRAS_WORKSPACE_QUOTA_MB", "512")) * 1024 * 1024)
+        self.workspace_ttl_seconds = int(os.getenv("ADRAS_WORKSPACE_TTL", "3600"))
+        # Requests uploading more than this go to a disk-backed root instead of
+        # tmpfs, with their own (larger) quota, so multi-GB CSVs can reach the
+        # partitioned file lane instead of filling RAM.
+        self.tmpfs_max_upload_bytes = int(float(os.getenv("ADRAS_TMPFS_MAX_UPLOAD_MB", "64")) * 1024 * 1024)
+        self.workspace_disk_root = os.getenv("ADRAS_WORKSPACE_DISK_ROOT", "")
+        self.workspace_disk_quota_bytes = int(float(os.getenv("ADRAS_WORKSPACE_DISK_QUOTA_MB", "20480")) * 1024 * 1024)
+        self.sweep_interval_seconds = int(os.getenv("ADRAS_SWEEP_INTERVAL", "300"))
+
+        # Deadline-aware iteration scheduler (see scheduler.py). Requests may
+        # set their own deadline with the X-Adras-Deadline header.
+        self.request_deadline_seconds = float(os.getenv("ADRAS_REQUEST_DEADLINE", "170"))
+        self.max_request_deadline_seconds = float(os.getenv("ADRAS_MAX_REQUEST_DEADLINE", "900"))
+        self.max_iterations = int(os.getenv("ADRAS_MAX_ITERATIONS", "10"))
+        self.deadline_margin_seconds = float(os.getenv("ADRAS_DEADLINE_MARGIN", "5"))
+
+        # Out-of-core file lane: CSVs above this size run as partitioned
+        # map/reduce. 0 means available memory * MEMORY_FRACTION / PANDAS_EXPANSION (partitioned.py).
+        self.partition_threshold_bytes = int(float(os.getenv("ADRAS_PARTITION_THRESHOLD_MB", "0")) * 1024 * 1024)
+        self.partition_workers = int(os.getenv("ADRAS_PARTITION_WORKERS", "0")) or (os.cpu_count() or 1)
+
+        # External lane: local block cache for remote datasets (see block_cache.py)
+        self.block_cache_dir = os.getenv("ADRAS_BLOCK_CACHE_DIR", "") or os.path.join(tempfile.gettempdir(), "adras_block_cache")
+        self.block_cache_max_bytes = int(float(os.getenv("ADRAS_BLOCK_CACHE_MB", "2048")) * 1024 * 1024)
+        self.block_size = int(float(os.getenv("ADRAS_BLOCK_SIZE_KB", "1024")) * 1024)
+        self.block_meta_ttl_seconds = int(os.getenv("ADRAS_BLOCK_META_TTL", "300"))
+        self.s3_endpoint = os.getenv("ADRAS_S3_ENDPOINT", "")
+
+        # Multi-part questions: split into parts that are solved in parallel,
+        # each with its own small iteration budget (see decompose.py).
+        self.decompose_questions = os.getenv("ADRAS_DECOMPOSE", "0") not in ("0", "false", "no")
+        self.decompose_workers = int(os.getenv("ADRAS_DECOMPOSE_WORKERS", "4"))
+        self.part_max_iterations = int(os.getenv("ADRAS_PART_MAX_ITERATIONS", "3"))
+
+        # Startup: lanes are imported on first use, or warmed in the background
+        # this many seconds after the server starts accepting connections.
+        self.warm_lanes = os.getenv("ADRAS_WARM_LANES", "1") not in ("0", "false", "no")
+        self.warm_delay_seconds = float(os.getenv("ADRAS_WARM_DELAY", "1.0"))
+
+
+settings = Settings()
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client(timeout=None):
+    """
+    Return the shared Groq client, constructing it (and importing groq) on
+    first use. With timeout, calls through it make a single attempt bounded by
+    timeout seconds, so they can't outlast the request deadline.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from groq import Groq
+                _client = Groq(api_key=settings.groq_api_key, base_url=settings.groq_base_url)
+    if timeout is None:
+        return _client
+    return _client.with_options(timeout=timeout, max_retries=0)
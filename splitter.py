@@ -1,17 +1,15 @@
 import os
 import json
-from groq import Groq
-from dotenv import load_dotenv
+from settings import get_client
+from workspace import request_dir
 
-load_dotenv()
-
-def classify_from_req_id(req_id: str) -> str:
+def classify_from_req_id(req_id: str, timeout=None) -> str:
     """
     Reads temp/<req_id>/questions.txt and asks Groq to classify the lane.
     Returns one of: "web", "file", "mixed", "external_data", or "other".
     """
-    client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-    q_path = os.path.join("temp", req_id, "questions.txt")
+    client = get_client(timeout)
+    q_path = os.path.join(request_dir(req_id), "questions.txt")
     if not os.path.exists(q_path):
         raise FileNotFoundError(f"questions.txt not found at {q_path}")
 
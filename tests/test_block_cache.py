@@ -0,0 +1,188 @@
+import hashlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import block_cache
+from block_cache import BlockCache, CachedFile, ProxyHandler
+
+BLOCK = 16
+DATA = bytes(range(256)) * 2  # 512 bytes, 32 blocks
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves in-memory objects with ETags, honouring single Range requests unless told not to."""
+    objects = {}
+    honour_ranges = True
+    gets = []
+
+    def _headers(self, body, status, extra=()):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"%s"' % hashlib.md5(body).hexdigest())
+        if self.honour_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        for key, value in extra:
+            self.send_header(key, value)
+        self.end_headers()
+
+    def do_HEAD(self):
+        body = self.objects.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        self._headers(body, 200)
+
+    def do_GET(self):
+        body = self.objects.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        header = self.headers.get("Range")
+        type(self).gets.append((self.path, header))
+        if header and self.honour_ranges:
+            first, _, last = header[len("bytes="):].partition("-")
+            start, end = int(first), min(int(last), len(body) - 1)
+            part = body[start:end + 1]
+            self._headers(part, 206, [("Content-Range", f"bytes {start}-{end}/{len(body)}")])
+            self.wfile.write(part)
+        else:
+            self._headers(body, 200)
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    RangeHandler.objects = {"/data.bin": DATA}
+    RangeHandler.honour_ranges = True
+    RangeHandler.gets = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return BlockCache(root=str(tmp_path / "cache"), block_size=BLOCK, max_bytes=10 * 1024 * 1024)
+
+
+def test_misses_then_hits(server, cache):
+    url = f"{server}/data.bin"
+    assert cache.read(url, 0, 40) == DATA[:40]
+    assert (cache.stats["misses"], cache.stats["hits"]) == (3, 0)
+    fetched = len(RangeHandler.gets)
+
+    assert cache.read(url, 0, 40) == DATA[:40]
+    assert (cache.stats["misses"], cache.stats["hits"]) == (3, 3)
+    assert len(RangeHandler.gets) == fetched
+
+
+def test_new_etag_invalidates_blocks(server, tmp_path):
+    cache = BlockCache(root=str(tmp_path / "cache"), block_size=BLOCK, max_bytes=1024 * 1024, meta_ttl=0)
+    url = f"{server}/data.bin"
+    assert cache.read(url, 0, BLOCK) == DATA[:BLOCK]
+
+    changed = b"x" * len(DATA)
+    RangeHandler.objects["/data.bin"] = changed
+    assert cache.read(url, 0, BLOCK) == changed[:BLOCK]
+    assert cache.stats["misses"] == 2 and cache.stats["hits"] == 0
+
+
+def test_evicts_least_recently_used(server, tmp_path):
+    # Room for 4 blocks; eviction trims to 90%, i.e. 3 blocks
+    cache = BlockCache(root=str(tmp_path / "cache"), block_size=BLOCK, max_bytes=4 * BLOCK)
+    url = f"{server}/data.bin"
+    meta = cache.stat(url)
+    for index in range(4):
+        cache.read(url, index * BLOCK, BLOCK)
+        time.sleep(0.01)
+    cache.read(url, 0, BLOCK)  # block 0 is now the most recently used
+    time.sleep(0.01)
+    cache.read(url, 4 * BLOCK, BLOCK)
+
+    kept = {i for i in range(5) if os.path.exists(cache._block_path(meta["url"], meta["etag"], i))}
+    assert kept == {0, 3, 4}
+    assert cache.stats["evicted"] == 2
+
+
+def test_size_bound_holds_across_short_lived_readers(server, tmp_path):
+    # Each instance stands in for one generated program: it writes a single
+    # block, far below 5% of max_bytes, so only a shared counter triggers eviction
+    root = str(tmp_path / "cache")
+    max_bytes = 40 * BLOCK
+    RangeHandler.objects["/big.bin"] = os.urandom(200 * BLOCK)
+    for index in range(200):
+        BlockCache(root=root, block_size=BLOCK, max_bytes=max_bytes).read(f"{server}/big.bin", index * BLOCK, BLOCK)
+    total, _ = BlockCache(root=root, block_size=BLOCK, max_bytes=max_bytes).usage()
+    assert total <= max_bytes
+
+
+def test_server_ignoring_ranges_is_fetched_once(server, cache):
+    RangeHandler.honour_ranges = False
+    url = f"{server}/data.bin"
+    assert cache.stat(url)["ranges"] is False
+    probes = len(RangeHandler.gets)
+
+    assert cache.read(url, 0, 5 * BLOCK) == DATA[:5 * BLOCK]
+    assert cache.read(url, 20 * BLOCK, 3 * BLOCK) == DATA[20 * BLOCK:23 * BLOCK]
+    assert len(RangeHandler.gets) - probes == 1
+    assert cache.stats["bytes_fetched"] == len(DATA)
+
+
+def test_cached_file_seek_and_read_across_blocks(server, cache):
+    f = CachedFile(f"{server}/data.bin", cache=cache)
+    assert f.seek(BLOCK - 3) == BLOCK - 3
+    buf = bytearray(2 * BLOCK + 6)
+    assert f.readinto(buf) == len(buf)
+    assert bytes(buf) == DATA[BLOCK - 3:3 * BLOCK + 3]
+    assert f.tell() == 3 * BLOCK + 3
+
+    f.seek(-10, os.SEEK_END)
+    buf = bytearray(64)
+    assert f.readinto(buf) == 10
+    assert bytes(buf[:10]) == DATA[-10:]
+
+    f.seek(5)
+    f.seek(7, os.SEEK_CUR)
+    buf = bytearray(4)
+    f.readinto(buf)
+    assert bytes(buf) == DATA[12:16]
+
+
+@pytest.fixture
+def proxy(server, cache, monkeypatch):
+    monkeypatch.setattr(block_cache, "_cache", cache)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ProxyHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    monkeypatch.setenv(block_cache.PROXY_ENV, f"http://127.0.0.1:{httpd.server_address[1]}")
+    yield block_cache.cached_url(f"{server}/data.bin")
+    httpd.shutdown()
+
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=5-9", 5, 9),
+    ("bytes=-10", len(DATA) - 10, len(DATA) - 1),
+    ("bytes=500-", 500, len(DATA) - 1),
+    ("bytes=30-100000", 30, len(DATA) - 1),
+])
+def test_proxy_range_requests(proxy, header, start, end):
+    resp = requests.get(proxy, headers={"Range": header}, timeout=10)
+    assert resp.status_code == 206
+    assert resp.headers["Content-Range"] == f"bytes {start}-{end}/{len(DATA)}"
+    assert resp.content == DATA[start:end + 1]
+
+
+def test_proxy_full_get_and_head(proxy):
+    resp = requests.get(proxy, timeout=10)
+    assert resp.status_code == 200 and resp.content == DATA
+    head = requests.head(proxy, timeout=10)
+    assert head.headers["Content-Length"] == str(len(DATA))
+    assert head.headers["Accept-Ranges"] == "bytes"
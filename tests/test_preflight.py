@@ -0,0 +1,95 @@
+import pytest
+
+from preflight import check_code, column_hints, MAP_REDUCE, PRINT_ANY, PRINT_JSON
+
+METADATA = [{
+    "file": "sales.csv",
+    "columns": ["region", "amount", "date"],
+    "dtypes": {"region": "object", "amount": "float64", "date": "object"},
+}]
+READ = 'import json\nimport pandas as pd\ndf = pd.read_csv("files/sales.csv")\n'
+
+
+@pytest.mark.parametrize("code", [
+    READ + 'print(json.dumps({"total": float(df["amount"].sum())}))',
+    READ + 'out = json.dumps({"total": float(df["amount"].sum())})\nprint(out)',
+    READ + 'print(df.groupby("region")["amount"].sum().to_json())',
+    READ + 'result = df.to_json(orient="records")\nprint(result)',
+    READ + 'import sys\njson.dump({"n": len(df)}, sys.stdout)',
+    READ + 'import sys\nsys.stdout.write(json.dumps({"n": len(df)}))',
+])
+def test_accepts_json_output(code):
+    assert check_code(code) is None
+
+
+def test_rejects_missing_json_print():
+    feedback = check_code(READ + 'print(df["amount"].sum())')
+    assert "never prints the final answer" in feedback
+
+
+def test_print_any_and_map_reduce_contracts():
+    assert check_code("print('x')", contract=PRINT_ANY) is None
+    assert "never prints" in check_code("x = 1", contract=PRINT_ANY)
+    code = "def map_partition(df, info):\n    return len(df)\n"
+    assert "reduce_partials" in check_code(code, contract=MAP_REDUCE)
+
+
+def test_syntax_error_and_imports():
+    assert "SyntaxError" in check_code("print(")
+    assert "not allowed" in check_code("import subprocess\nprint(1)", contract=PRINT_ANY)
+    assert "not installed" in check_code("import no_such_module_xyz\nprint(1)", contract=PRINT_ANY)
+
+
+def test_unknown_column_with_hint():
+    # Column findings never block a run; they are attached to the step's errors
+    feedback = column_hints(READ + 'print(json.dumps(float(df["amont"].sum())))', METADATA)
+    assert "column 'amont' does not exist" in feedback
+    assert "Did you mean 'amount'?" in feedback
+
+
+def test_usecols_and_groupby_are_checked():
+    code = 'import json\nimport pandas as pd\ndf = pd.read_csv("files/sales.csv", usecols=["regio"])\nprint(json.dumps(1))'
+    assert "'regio'" in column_hints(code, METADATA)
+    assert "'zone'" in column_hints(READ + 'g = df.groupby("zone")\nprint(json.dumps(1))', METADATA)
+
+
+@pytest.mark.parametrize("body", [
+    # columns renamed wholesale or through rename()
+    'df.columns = ["a", "b", "c"]\nprint(json.dumps(float(df["a"].sum())))',
+    'df = df.rename(columns={"amount": "value"})\nprint(json.dumps(float(df["value"].sum())))',
+    # columns the code creates itself
+    'df["year"] = df["date"].str[:4]\nprint(json.dumps(df["year"].tolist()))',
+    'df = df.assign(total=df["amount"] * 2)\nprint(json.dumps(float(df["total"].sum())))',
+    # merges bring in columns from another frame
+    'other = pd.DataFrame({"region": ["n"], "target": [1.0]})\n'
+    'm = df.merge(other, on="region")\nprint(json.dumps(float(m["target"].sum())))',
+    # .loc selections and assignments
+    'df.loc[:, "flag"] = df["amount"] > 10\nprint(json.dumps(int(df.loc[df["flag"], "amount"].count())))',
+    'sub = df.loc[df["amount"] > 10]\nprint(json.dumps(sub["region"].tolist()))',
+    # frames reassigned to something with different columns
+    'df = df.pivot_table(index="region", values="amount")\nprint(json.dumps(df["amount"].tolist()))',
+    'df = df.groupby("region").agg(mean_amount=("amount", "mean"))\nprint(json.dumps(df["mean_amount"].tolist()))',
+    # computed column names and df.eval assignments
+    'for col in ["x", "y"]:\n    df[col] = df["amount"] * 2\nprint(json.dumps(float(df["x"].sum())))',
+    'df.eval("c = amount * 2\\nd = c + 1", inplace=True)\nprint(json.dumps(float(df["d"].sum())))',
+])
+def test_no_false_positives_for_derived_columns(body):
+    assert column_hints(READ + body, METADATA) == ""
+
+
+@pytest.mark.parametrize("code", [
+    # data the metadata does not describe
+    'import json\nimport pandas as pd\nx = pd.read_csv("https://example.com/other.csv")\nprint(json.dumps(x["anything"].tolist()))',
+    'import json\nimport pandas as pd\nx = pd.DataFrame({"k": [1]})\nprint(json.dumps(x["k"].tolist()))',
+    # explicit labels replace the probed header
+    'import json\nimport pandas as pd\nx = pd.read_csv("files/sales.csv", names=["a", "b", "c"])\nprint(json.dumps(x["a"].tolist()))',
+    'import json\nimport pandas as pd\nx = pd.read_csv("files/sales.csv", header=None)\nprint(json.dumps(x[0].tolist()))',
+    # a preamble row skipped: the probe's labels were the preamble's
+    'import json\nimport pandas as pd\nx = pd.read_csv("files/sales.csv", skiprows=2, usecols=["Revenue"])\nprint(json.dumps(float(x["Revenue"].sum())))',
+])
+def test_no_false_positives_for_unknown_sources(code):
+    assert column_hints(code, METADATA) == ""
+
+
+def test_check_code_ignores_columns():
+    assert check_code(READ + 'print(json.dumps(float(df["amont"].sum())))') is None
@@ -1,36 +1,38 @@
 import re
 import os
-from groq import Groq
 from scraper import scrape
-from dotenv import load_dotenv
-import subprocess
+from settings import settings, get_client
+from workspace import request_dir, run_step
+from scheduler import RequestBudget
+from preflight import check_code, column_hints, PRINT_JSON
+from ingest import materialize_html_tables
 import json
 
-load_dotenv()
-api_key = os.getenv("GROQ_API_KEY")
-client = Groq(api_key=api_key)
-
 # Extract URLs from the questions as a list
 def extract_urls(questions):
     urls = re.findall(r'https?://[^\s]+', questions)
     return urls
 
-def scrape_tables(urls):
+def scrape_tables(urls, req_dir, budget=None):
     tables = []
-    for url in urls:
-        tables.append(scrape(url))
+    # Scraping metadata may use at most a third of the time that is left, over
+    # all URLs together; each URL gets an even share of what is still unused
+    share = budget.sub_budget(1 / 3) if budget else None
+    for i, url in enumerate(urls):
+        sub_budget = share.sub_budget(1 / (len(urls) - i), max_iterations=5) if share else None
+        tables.append(scrape(url, req_dir, budget=sub_budget))
     return tables
 
-def ask_llm(messages):
-    response = client.chat.completions.create(
+def ask_llm(messages, timeout=None):
+    response = get_client(timeout).chat.completions.create(
         messages=messages,
         model="llama-3.3-70b-versatile",
         temperature=0,
     )
     return response.choices[0].message.content
 
-def checker_llm(question, summarized_stdout, stderr):
-    response = client.chat.completions.create(
+def checker_llm(question, summarized_stdout, stderr, timeout=None):
+    response = get_client(timeout).chat.completions.create(
         messages=[
             {"role": "system", "content": "You are a binary task checker. Answer exactly 'yes' if the code output successfully matches the expected output even if the base64 is truncated, else answer 'no'."},
             {"role": "user", "content": f"User question:\n{question}\n\nCode output:\n{summarized_stdout}\n\nCode errors:\n{stderr}\n\nIf the task is complete and the output contains the requested final result in JSON form (base64 will be truncated), reply 'yes'. Otherwise reply 'no'."}
@@ -111,17 +113,12 @@ def extract_json(text: str) -> str:
 	# Reached end without closing the outermost structure – return original
 	return text
 
-def run_code(code):
-    try:
-        result = subprocess.run(
-            ["python3", "-c", code],
-            capture_output=True,
-            text=True,
-            timeout=120
-        )
-        return result.stdout, result.stderr
-    except Exception as e:
-        return "", str(e)
+# Upper bound for one step; the request budget usually hands out less
+MAX_STEP_TIMEOUT = 120
+
+def run_code(code, req_dir, timeout=MAX_STEP_TIMEOUT):
+    """Run code inside the request workspace, with its quota enforced while it runs."""
+    return run_step(["python3", "-c", code], req_dir, timeout)
 
 def replace_base64(text: str) -> str:
     """Truncate long base64-like strings in the given text to avoid context bloat."""
@@ -140,7 +137,7 @@ You must:
     •	Write Python code to complete the task step by step. At each step, you will be given the original question and any previous code+output.
     •   For scraping online tables, never assume column names or structure. First inspect the table using df.head() and df.columns. If numeric values contain footnotes, symbols (like $, ,, [1], or even stray characters like T$), clean them using regular expressions before type conversion.
     •	If numeric conversion fails (e.g., "24RK"), extract only leading digits using re.search(r'^\d+', str(x)). Never use re.sub(r'[^\d.]', '', ...) — that can turn "TS3" into 3, which is incorrect.
-    •	Prefer using pandas.read_html() to inspect tables on web pages unless explicitly instructed otherwise.
+    •	Tables on the question's web pages have already been parsed and saved; the table manifest lists each one with its path, columns, original header levels and sample rows. Load them with pd.read_parquet(path) (pd.read_pickle for .pkl) instead of fetching the page again. raw_path holds the same table with every cell as the original text, for when parsed values lost information. Only fall back to pandas.read_html() on a saved page or URL if a table you need is not in the manifest.
     •	If a specific format (e.g. JSON array, base64 plot) is requested, format output accordingly.
     •	Return only the Python code, with no explanation or markdown formatting.
     •	When working with large datasets, never load the entire dataset into memory. Only load the necessary columns or rows.
@@ -148,40 +145,72 @@ You must:
     •	Always end your code with: import json; print(json.dumps(final_output)), where final_output is the answer in the requested format. Never use print(final_output) directly.
 """
 
-def web_pipeline(req_id):
-    question = open(f"temp/{req_id}/questions.txt").read()
+def stage_tables(urls, req_dir, budget=None):
+    """
+    Parse every table on the URLs once into the request dir. The LLM-driven
+    scraper only runs for URLs where that produced no tables.
+    """
+    manifest = materialize_html_tables(urls, req_dir, budget=budget)
+    staged = {t["url"] for t in manifest["tables"]}
+    missing = [url for url in urls if url not in staged]
+    manifest["table_metadata"] = scrape_tables(missing, req_dir, budget=budget) if missing else []
+    return manifest
+
+def web_pipeline(req_id, budget=None):
+    budget = budget or RequestBudget()
+    req_dir = request_dir(req_id)
+    question = open(os.path.join(req_dir, "questions.txt")).read()
     urls = extract_urls(question)
-    tables = scrape_tables(urls)
+    tables = stage_tables(urls, req_dir, budget=budget)
     question_with_struct = {
         "question": question,
-        "table_metadata": tables
+        "table_manifest": tables["tables"],
+        "pages": tables["pages"],
+        "staging_errors": tables["errors"],
+        "table_metadata": tables["table_metadata"]
     }
+    if settings.decompose_questions:
+        from decompose import solve_in_parts
+        context = json.dumps({k: v for k, v in question_with_struct.items() if k != "question"}, default=str)
+        result = solve_in_parts(question, system_prompt, context, req_dir, metadata=tables, budget=budget)
+        if result is not None:
+            return result
     messages = [
         {"role": "system", "content": system_prompt},
-        {"role": "user", "content": json.dumps(question_with_struct)}
+        {"role": "user", "content": json.dumps(question_with_struct, default=str)}
     ]
-    max_iterations = 10
-    iteration = 0
     stdout=""
-    while iteration < max_iterations:
-        iteration += 1
-        print(f"\n=== Iteration {iteration} ===")
-        raw_code = ask_llm(messages)
+    while budget.can_iterate():
+        iteration = budget.start_iteration()
+        print(f"\n=== Iteration {iteration} ({budget.remaining():.0f}s left) ===")
+        with budget.timed("llm"):
+            raw_code = ask_llm(messages, timeout=budget.llm_timeout())
         code = extract_python_code(raw_code)
         print(f"Generated code:\n{code}")
-        stdout, stderr = run_code(code)
+        preflight_feedback = check_code(code, PRINT_JSON)
+        if preflight_feedback:
+            messages.append({"role": "assistant", "content": code})
+            messages.append({"role": "user", "content": preflight_feedback})
+            continue
+        with budget.timed("exec"):
+            stdout, stderr = run_code(code, req_dir, timeout=budget.step_timeout(MAX_STEP_TIMEOUT))
+        if stderr.strip():
+            stderr += column_hints(code, tables)
         print(f"Code output:\n{stdout}\nErrors:\n{stderr}")
-        if (checker_llm(question, replace_base64(stdout), stderr) == "yes"):
+        with budget.timed("check"):
+            done = checker_llm(question, replace_base64(stdout), stderr, timeout=budget.llm_timeout()) == "yes"
+        if done:
             print("Task complete. Returning final output.")
             return json.loads(stdout)
         else:
             messages.append({"role": "assistant", "content": code})
             messages.append({"role": "user", "content": "Output = " + replace_base64(stdout) + "\nErrors = " + stderr})
             
-    print("Max iterations reached. Task failed.")
-    return json.loads(fail_proof(stdout, question))
+    print("Request budget exhausted. Task failed.")
+    budget.outcome = "fallback"
+    return json.loads(fail_proof(stdout, question, timeout=budget.llm_timeout(fallback=True)))
 
-def stub_response_former(question):
+def stub_response_former(question, timeout=None):
     #use an llm to generate a any answer for the given question but in the exact format requested. if it can give correct answer great, but if it cant it must only respond with a fake answer but in the exact same format as asked in the question. this is a fallback option.
     fallback_prompt = """
     You are an AI that must answer any given question strictly in the exact format requested by the user.
@@ -191,7 +220,7 @@ def stub_response_former(question):
 * Do not mention whether the answer is real or fake.
 * Do not explain your reasoning or add extra commentary. Only output the answer in the format requested.
 """
-    response = client.chat.completions.create(
+    response = get_client(timeout).chat.completions.create(
         messages=[
             {"role": "system", "content": fallback_prompt},
             {"role": "user", "content": question}
@@ -202,11 +231,11 @@ def stub_response_former(question):
     fake_json=json.loads(extract_json(response.choices[0].message.content))
     return json.dumps(fake_json)
 
-def fail_proof(stdout,question):
+def fail_proof(stdout,question, timeout=None):
     if not stdout:
-        return stub_response_former(question)
+        return stub_response_former(question, timeout)
     try:
         json.loads(extract_json(stdout))
         return extract_json(stdout)
     except Exception:
-        return stub_response_former(question)
+        return stub_response_former(question, timeout)
@@ -0,0 +1,347 @@
+import os
+import resource
+import shutil
+import signal
+import subprocess
+import time
+import threading
+from settings import settings
+
+# Per-request workspaces live under one root. Prefer a RAM-backed tmpfs
+# (/dev/shm) so generated code, uploads and step files never touch app disk.
+# Requests with large uploads go to a disk-backed root instead.
+WORKSPACE_ROOT = settings.workspace_root
+TMPFS_CANDIDATES = ["/dev/shm"]
+TMPFS_MIN_FREE_BYTES = 256 * 1024 * 1024
+DISK_ROOT = settings.workspace_disk_root
+TMPFS_MAX_UPLOAD_BYTES = settings.tmpfs_max_upload_bytes
+
+QUOTA_BYTES = settings.workspace_quota_bytes
+DISK_QUOTA_BYTES = settings.workspace_disk_quota_bytes
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# How often a running step's workspace is measured against the quota
+QUOTA_POLL_SECONDS = 1.0
+ORPHAN_TTL_SECONDS = settings.workspace_ttl_seconds
+SWEEP_INTERVAL_SECONDS = settings.sweep_interval_seconds
+
+OWNER_FILE = ".owner"
+# A dir this young without an owner file may still be being created by another worker
+OWNER_GRACE_SECONDS = 60
+
+_lock = threading.Lock()
+_active = set()
+_root = None
+_is_tmpfs = False
+_disk_root = None
+_placed = {}
+_counters = {"created": 0, "released": 0, "swept": 0, "quota_exceeded": 0}
+
+
+class WorkspaceQuotaExceeded(RuntimeError):
+    pass
+
+
+def _free_bytes(path):
+    try:
+        st = os.statvfs(path)
+        return st.f_bavail * st.f_frsize
+    except (OSError, AttributeError):
+        return 0
+
+
+def _pick_root():
+    if WORKSPACE_ROOT:
+        return WORKSPACE_ROOT, False
+    for candidate in TMPFS_CANDIDATES:
+        if os.path.isdir(candidate) and os.access(candidate, os.W_OK) \
+                and _free_bytes(candidate) >= TMPFS_MIN_FREE_BYTES:
+            return os.path.join(candidate, "adras"), True
+    return os.path.join(os.getcwd(), "temp"), False
+
+
+def workspace_root():
+    """Return the directory holding all request workspaces, creating it on first use."""
+    global _root, _is_tmpfs
+    if _root is None:
+        root, is_tmpfs = _pick_root()
+        os.makedirs(root, exist_ok=True)
+        _root, _is_tmpfs = root, is_tmpfs
+        print(f"Workspace root: {_root} (tmpfs={_is_tmpfs})")
+    return _root
+
+
+def disk_root():
+    """Disk-backed root for requests with large uploads; the workspace root itself when that is not tmpfs."""
+    global _disk_root
+    root = workspace_root()
+    if not _is_tmpfs:
+        return root
+    if _disk_root is None:
+        _disk_root = DISK_ROOT or os.path.join(os.getcwd(), "temp")
+        os.makedirs(_disk_root, exist_ok=True)
+    return _disk_root
+
+
+def _roots():
+    return [workspace_root()] + ([disk_root()] if _is_tmpfs else [])
+
+
+def request_dir(req_id: str) -> str:
+    with _lock:
+        placed = _placed.get(req_id)
+    return placed or os.path.join(workspace_root(), req_id)
+
+
+def quota_bytes(req_dir: str) -> int:
+    """Quota for one workspace: QUOTA_BYTES on tmpfs, DISK_QUOTA_BYTES on disk."""
+    on_tmpfs = _is_tmpfs and os.path.dirname(os.path.normpath(req_dir)) == workspace_root()
+    return QUOTA_BYTES if on_tmpfs else DISK_QUOTA_BYTES
+
+
+def create_request_dir(req_id: str, upload_bytes: int = 0) -> str:
+    """
+    Create <root>/<req_id> with files/ and images/ and mark it as owned by
+    this process. Requests uploading more than TMPFS_MAX_UPLOAD_BYTES are
+    placed on the disk-backed root.
+    """
+    workspace_root()
+    root = disk_root() if upload_bytes > TMPFS_MAX_UPLOAD_BYTES else workspace_root()
+    req_dir = os.path.join(root, req_id)
+    # Claim the dir before filling it, so a sweep in another worker sees an owner
+    os.makedirs(req_dir, exist_ok=True)
+    with open(os.path.join(req_dir, OWNER_FILE), "w") as f:
+        f.write(str(os.getpid()))
+    os.makedirs(os.path.join(req_dir, "images"), exist_ok=True)
+    os.makedirs(os.path.join(req_dir, "files"), exist_ok=True)
+    with _lock:
+        _active.add(req_id)
+        _placed[req_id] = req_dir
+        _counters["created"] += 1
+    return req_dir
+
+
+def release_request_dir(req_dir: str):
+    req_id = os.path.basename(os.path.normpath(req_dir))
+    try:
+        shutil.rmtree(req_dir)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Failed to delete temp dir {req_dir}: {e}")
+    with _lock:
+        _active.discard(req_id)
+        _placed.pop(req_id, None)
+        _counters["released"] += 1
+
+
+def dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                continue
+    return total
+
+
+def _quota_exceeded(used, quota):
+    with _lock:
+        _counters["quota_exceeded"] += 1
+    return WorkspaceQuotaExceeded(f"workspace uses {used} bytes, quota is {quota} bytes")
+
+
+def check_quota(req_dir: str, extra_bytes: int = 0):
+    """Raise WorkspaceQuotaExceeded if the workspace (plus extra_bytes about to be written) is over quota."""
+    used = dir_size(req_dir) + extra_bytes
+    quota = quota_bytes(req_dir)
+    if used > quota:
+        raise _quota_exceeded(used, quota)
+    return used
+
+
+def _remove_new_files(req_dir, since, quota):
+    """Delete files written since `since`, largest first, until req_dir is back under quota (with room to write)."""
+    new = []
+    for dirpath, _, filenames in os.walk(req_dir):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if st.st_mtime >= since:
+                new.append((st.st_size, path))
+    used = dir_size(req_dir)
+    for size, path in sorted(new, reverse=True):
+        if used < quota:
+            break
+        try:
+            os.remove(path)
+            used -= size
+        except OSError:
+            continue
+
+
+def run_step(cmd, req_dir: str, timeout: float):
+    """
+    Run a generated-code step (cmd) inside req_dir with the quota enforced
+    while it runs: no file may grow past the quota left when it starts
+    (RLIMIT_FSIZE), the workspace is measured every QUOTA_POLL_SECONDS and
+    the step is killed once it is over, and files it wrote beyond the quota
+    are deleted. Returns (stdout, stderr); TIMEOUT/QUOTA notes end stderr.
+    """
+    quota = quota_bytes(req_dir)
+    remaining = max(quota - dir_size(req_dir), 0)
+    started = time.time()
+
+    def limit_file_size():
+        resource.setrlimit(resource.RLIMIT_FSIZE, (remaining, remaining))
+
+    try:
+        # Own process group, so a kill also reaches pools the step starts
+        proc = subprocess.Popen(cmd, cwd=req_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                text=True, errors="replace", preexec_fn=limit_file_size, start_new_session=True)
+    except Exception as e:
+        return "", str(e)
+
+    stopped = None
+    while stopped is None:
+        try:
+            stdout, stderr = proc.communicate(timeout=max(0.0, min(QUOTA_POLL_SECONDS, started + timeout - time.time())))
+            break
+        except subprocess.TimeoutExpired:
+            pass
+        if time.time() - started >= timeout:
+            stopped = "timeout"
+        elif dir_size(req_dir) > quota:
+            stopped = "quota"
+        else:
+            continue
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        stdout, stderr = proc.communicate()
+
+    note = f"\nTIMEOUT: exceeded {timeout:.0f}s" if stopped == "timeout" else ""
+    used = dir_size(req_dir)
+    if used > quota or stopped == "quota" or "File too large" in (stderr or ""):
+        note += f"\nQUOTA: {_quota_exceeded(used, quota)}."
+        if used >= quota:
+            _remove_new_files(req_dir, started, quota)
+            note += " The files the step wrote over the quota were deleted."
+        note += " Write less data to disk."
+    return stdout or "", (stderr or "") + note
+
+
+def save_upload(src, dest_path: str, req_dir: str) -> int:
+    """
+    Stream the file object src to dest_path in chunks, never holding the
+    whole upload in memory. The quota is checked against the bytes written
+    so far; on overflow the partial file is removed.
+    """
+    quota = quota_bytes(req_dir)
+    used = dir_size(req_dir)
+    written = 0
+    try:
+        with open(dest_path, "wb") as f:
+            while True:
+                chunk = src.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if used + written > quota:
+                    raise _quota_exceeded(used + written, quota)
+                f.write(chunk)
+    except WorkspaceQuotaExceeded:
+        os.remove(dest_path)
+        raise
+    return written
+
+
+def _owner_alive(req_dir):
+    try:
+        with open(os.path.join(req_dir, OWNER_FILE)) as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def sweep_orphans(ttl_seconds: int = ORPHAN_TTL_SECONDS) -> int:
+    """
+    Delete request directories that no live request owns: either the owning
+    worker process is gone, or the directory is older than ttl_seconds (this
+    worker's own requests included).
+    """
+    now = time.time()
+    removed = 0
+    paths = []
+    for root in _roots():
+        try:
+            paths.extend(os.path.join(root, name) for name in os.listdir(root))
+        except FileNotFoundError:
+            continue
+    for path in paths:
+        name = os.path.basename(path)
+        if not os.path.isdir(path):
+            continue
+        try:
+            age = now - os.path.getmtime(path)
+        except OSError:
+            continue
+        with _lock:
+            # Live requests are only kept until the TTL, so a leaked one is still reclaimed
+            if name in _active:
+                if age < ttl_seconds:
+                    continue
+                _active.discard(name)
+                _placed.pop(name, None)
+        if age < OWNER_GRACE_SECONDS and not os.path.exists(os.path.join(path, OWNER_FILE)):
+            continue
+        if _owner_alive(path) and age < ttl_seconds:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    if removed:
+        with _lock:
+            _counters["swept"] += removed
+        print(f"Swept {removed} orphaned workspace(s) from {', '.join(_roots())}")
+    return removed
+
+
+def usage() -> dict:
+    root = workspace_root()
+    dirs = 0
+    total = 0
+    for r in _roots():
+        try:
+            for name in os.listdir(r):
+                path = os.path.join(r, name)
+                if os.path.isdir(path):
+                    dirs += 1
+                    total += dir_size(path)
+        except FileNotFoundError:
+            pass
+    with _lock:
+        active = len(_active)
+        counters = dict(_counters)
+    return {
+        "root": root,
+        "tmpfs": _is_tmpfs,
+        "quota_bytes": QUOTA_BYTES,
+        "disk_root": disk_root(),
+        "disk_quota_bytes": DISK_QUOTA_BYTES,
+        "active": active,
+        "dirs": dirs,
+        "bytes": total,
+        "root_free_bytes": _free_bytes(root),
+        **counters,
+    }